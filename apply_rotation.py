@@ -1,38 +1,321 @@
+import argparse
 import os
+import shutil
+import struct
+import subprocess
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
 
-from PIL import Image
-
-from src.image_state import ImageState
-
-from .main import RAW_DIR
-
-
-def apply_rotation(states_path="image_states.txt", img_dir=RAW_DIR):
-    # 加载所有图片状态
-    images = [
-        ImageState(os.path.join(img_dir, f))
-        for f in sorted(os.listdir(img_dir))
-        if f.lower().endswith(('.png', '.jpg', '.jpeg', '.bmp'))
-    ]
-    # 读取状态文件
-    ImageState.load_all(images, states_path)
-    # 旋转图片并清除angle
-    for img_state in images:
-        if img_state.angle % 360 == 0:
-            continue
-        img_path = img_state.path
-        if not os.path.exists(img_path):
-            print(f"未找到图片: {img_path}")
-            continue
-        img = Image.open(img_path)
-        img = img.rotate(-img_state.angle, expand=True)
-        img.save(img_path)
-        print(f"{os.path.basename(img_path)} 已旋转 {img_state.angle} 度并覆盖原图")
-        img_state.angle = 0  # 清除angle
-    # 保存回文件
-    ImageState.save_all(images, states_path)
-    print("所有旋转已应用，angle 已清除。")
+from PIL import Image, TiffImagePlugin
+
+from src.image_state import (
+    ORIENTATION_MARKER,
+    ORIENTATION_TAG,
+    header_orientation,
+    read_legacy_states,
+    rotate_image,
+    upright,
+    write_legacy_states,
+)
+from src.pages import is_pdf, page_path, split_page
+from src.state_store import STATE_DB, StateStore
+
+RAW_DIR = 'raw'
+
+# 纯旋转的 EXIF 方向值与顺时针角度互相映射，镜像方向（2/4/5/7）不参与组合
+_ORIENTATION_ANGLE = {1: 0, 6: 90, 3: 180, 8: 270}
+_ANGLE_ORIENTATION = {v: k for k, v in _ORIENTATION_ANGLE.items()}
+
+
+def _atomic_write(path, write):
+    """先写同目录下的临时文件再改名覆盖，中途失败不会损坏原图"""
+    fd, tmp_path = tempfile.mkstemp(
+        dir=os.path.dirname(path) or '.', suffix=os.path.splitext(path)[1]
+    )
+    os.close(fd)
+    try:
+        write(tmp_path)
+        shutil.copymode(path, tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def _set_tiff_orientation(tiff, orientation):
+    """在 EXIF 的 TIFF 数据中设置 IFD0 方向标签，其余内容原样保留"""
+    endian = '<' if tiff[:2] == b'II' else '>'
+    ifd = struct.unpack_from(endian + 'I', tiff, 4)[0]
+    count = struct.unpack_from(endian + 'H', tiff, ifd)[0]
+    entries = [tiff[ifd + 2 + 12 * i : ifd + 14 + 12 * i] for i in range(count)]
+    for i, entry in enumerate(entries):
+        if struct.unpack_from(endian + 'H', entry)[0] == ORIENTATION_TAG:
+            pos = ifd + 2 + 12 * i + 8
+            return (
+                tiff[:pos]
+                + struct.pack(endian + 'HH', orientation, 0)
+                + tiff[pos + 4 :]
+            )
+    # 没有方向标签：在末尾追加一份带方向标签的 IFD0，并让文件头指向它
+    next_ifd = tiff[ifd + 2 + 12 * count : ifd + 6 + 12 * count]
+    entries.append(struct.pack(endian + 'HHIHH', ORIENTATION_TAG, 3, 1, orientation, 0))
+    entries.sort(key=lambda e: struct.unpack_from(endian + 'H', e)[0])
+    tiff += b'\0' * (len(tiff) % 2)
+    new_ifd = len(tiff)
+    tiff += struct.pack(endian + 'H', len(entries)) + b''.join(entries) + next_ifd
+    return tiff[:4] + struct.pack(endian + 'I', new_ifd) + tiff[8:]
+
+
+def _segment(marker, payload):
+    if len(payload) + 2 > 0xFFFF:
+        raise ValueError("JPEG 段过大")
+    return b'\xff' + bytes([marker]) + struct.pack('>H', len(payload) + 2) + payload
+
+
+def set_jpeg_orientation(data, orientation):
+    """只改写 JPEG 的 EXIF 方向标签，不重新编码图像数据
+
+    同时写入 ORIENTATION_MARKER 标记段，本工具只按带标记的方向摆正。
+    """
+    if data[:2] != b'\xff\xd8':
+        raise ValueError("不是 JPEG 文件")
+    pos = 2
+    insert_at = 2
+    exif = None
+    marked = False
+    while pos + 4 <= len(data) and data[pos] == 0xFF:
+        marker = data[pos + 1]
+        # SOS 之后是压缩数据
+        if marker == 0xDA:
+            break
+        length = struct.unpack_from('>H', data, pos + 2)[0]
+        body = data[pos + 4 : pos + 2 + length]
+        if marker == 0xE1 and body[:6] == b'Exif\0\0' and exif is None:
+            exif = (pos, pos + 2 + length, body[6:])
+        elif marker == 0xEB and body.startswith(ORIENTATION_MARKER):
+            marked = True
+        # 新的 EXIF 段放在 JFIF 段之后
+        if marker == 0xE0:
+            insert_at = pos + 2 + length
+        pos += 2 + length
+    if exif is None:
+        start = end = insert_at
+        tiff = b'MM\0*\0\0\0\x08' + struct.pack(
+            '>HHHIHHI', 1, ORIENTATION_TAG, 3, 1, orientation, 0, 0
+        )
+    else:
+        start, end, tiff = exif
+        tiff = _set_tiff_orientation(tiff, orientation)
+    segments = _segment(0xE1, b'Exif\0\0' + tiff)
+    if not marked:
+        segments += _segment(0xEB, ORIENTATION_MARKER)
+    return data[:start] + segments + data[end:]
+
+
+def _jpegtran(path, angle):
+    def write(tmp_path):
+        subprocess.run(
+            [
+                'jpegtran',
+                '-copy',
+                'all',
+                '-perfect',
+                '-rotate',
+                str(angle),
+                '-outfile',
+                tmp_path,
+                path,
+            ],
+            check=True,
+            capture_output=True,
+        )
+
+    _atomic_write(path, write)
+
+
+def _write_orientation(path, orientation):
+    with open(path, 'rb') as f:
+        data = set_jpeg_orientation(f.read(), orientation)
+
+    def write(tmp_path):
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+
+    _atomic_write(path, write)
+
+
+def _save_params(img):
+    """保留原图压缩方式（TIFF）和分辨率的保存参数"""
+    params = {}
+    if img.format == 'TIFF':
+        params['compression'] = img.info.get('compression', 'raw')
+    if 'dpi' in img.info:
+        params['dpi'] = img.info['dpi']
+    return params
+
+
+def _reencode(path, angle):
+    with Image.open(path) as img:
+        fmt = img.format
+        params = {'format': fmt, **_save_params(img)}
+        # 先按本工具写入的方向摆正，与显示时一致
+        img = upright(img)
+    rotated = rotate_image(img, angle)
+    if fmt == 'JPEG':
+        # 像素已是显示的方向，去掉方向标签，其他软件也不会再转一次
+        exif = img.getexif()
+        exif.pop(ORIENTATION_TAG, None)
+        params.update(quality=95, exif=exif.tobytes())
+    _atomic_write(path, lambda tmp_path: rotated.save(tmp_path, **params))
+
+
+def rotate_file(path, angle, mode='auto'):
+    """把顺时针 angle 度的旋转落到文件上，返回实际使用的方式
+
+    JPEG 旋转 90 的倍数时不重新编码：jpegtran 模式在 DCT 域无损转置，
+    exif 模式只改写 EXIF 方向标签并写入标记（本工具读取时按带标记的方向摆正）。
+    auto 优先 jpegtran，不可用或图片尺寸不是整块时退回 exif。
+    其他格式或任意角度直接转置/旋转后重新保存。
+    """
+    angle %= 360
+    with Image.open(path) as img:
+        fmt = img.format
+        # 没有标记的方向标签与显示时一样忽略，按 1 处理
+        orientation = header_orientation(img)
+    if fmt == 'JPEG' and angle in _ANGLE_ORIENTATION and mode != 'reencode':
+        if mode in ('auto', 'jpegtran') and orientation == 1:
+            if shutil.which('jpegtran'):
+                try:
+                    _jpegtran(path, angle)
+                    return 'jpegtran'
+                except subprocess.CalledProcessError:
+                    # -perfect 要求尺寸是 MCU 的整数倍
+                    if mode == 'jpegtran':
+                        raise
+            elif mode == 'jpegtran':
+                raise RuntimeError("未找到 jpegtran")
+        if orientation in _ORIENTATION_ANGLE:
+            total = (_ORIENTATION_ANGLE[orientation] + angle) % 360
+            _write_orientation(path, _ANGLE_ORIENTATION[total])
+            return 'exif'
+    _reencode(path, angle)
+    return 'reencode'
+
+
+def rotate_pages(path, angles):
+    """把各页的顺时针角度 {页码: 角度} 落到多页 TIFF 上
+
+    逐帧读取、摆正、旋转并追加写入新文件，同一时间只有一帧在内存中；
+    保留各帧的压缩方式和分辨率。与 rotate_file 一样返回使用的方式。
+    """
+
+    def write(tmp_path):
+        # 写完临时文件即关闭原图，Windows 上不能替换仍打开的文件
+        with Image.open(path) as img, TiffImagePlugin.AppendingTiffWriter(
+            tmp_path, new=True
+        ) as tf:
+            for index in range(img.n_frames):
+                img.seek(index)
+                frame = rotate_image(upright(img), angles.get(index + 1, 0))
+                frame.save(tf, format='TIFF', **_save_params(img))
+                tf.newFrame()
+
+    _atomic_write(path, write)
+    return 'reencode'
+
+
+def apply_rotation(
+    states_path="image_states.txt",
+    img_dir=RAW_DIR,
+    mode='auto',
+    workers=None,
+    db_path=STATE_DB,
+):
+    """把保存的角度写到原图上并清除 angle，返回旋转失败的文件名"""
+    # 读取状态：文本文件与 GUI 的状态库，状态库优先
+    entries = {}
+    if os.path.exists(states_path):
+        entries.update(read_legacy_states(states_path))
+    store = StateStore(db_path) if os.path.exists(db_path) else None
+    if store is not None:
+        entries.update((name, (angle, rects)) for name, angle, rects in store.items())
+    # 只打开需要旋转的图片
+    todo = {
+        name: angle
+        for name, (angle, _) in entries.items()
+        if angle % 360 != 0
+        and os.path.exists(os.path.join(img_dir, split_page(name)[0]))
+    }
+    for name, (angle, _) in entries.items():
+        if angle % 360 != 0 and name not in todo:
+            print(f"未找到图片: {os.path.join(img_dir, name)}")
+    # 多页文件的页按文件分组，每个文件只重写一次
+    files = {}
+    for name, angle in todo.items():
+        fname, page = split_page(name)
+        if page is None:
+            files[name] = None
+        elif is_pdf(fname):
+            print(f"{name} 是 PDF 页面，不支持写回旋转，保留 angle")
+        else:
+            files.setdefault(fname, {})[page] = angle
+    failed = []
+    try:
+        with ProcessPoolExecutor(workers) as executor:
+            futures = {}
+            for fname, pages in files.items():
+                path = os.path.join(img_dir, fname)
+                if pages is None:
+                    futures[fname] = executor.submit(
+                        rotate_file, path, todo[fname], mode
+                    )
+                else:
+                    futures[fname] = executor.submit(rotate_pages, path, pages)
+            for fname, future in futures.items():
+                # 单个文件失败时原图不变、保留其 angle，其余文件照常处理
+                try:
+                    used = future.result()
+                except Exception as e:
+                    print(f"{fname} 旋转失败，保留 angle: {e}")
+                    failed.append(fname)
+                    continue
+                if files[fname] is None:
+                    print(f"{fname} 已旋转 {todo[fname]} 度并覆盖原图（{used}）")
+                    names = [fname]
+                else:
+                    names = [page_path(fname, page) for page in sorted(files[fname])]
+                    print(f"{fname} 的 {len(names)} 页已旋转并覆盖原图（{used}）")
+                for name in names:
+                    # 清除angle
+                    entries[name] = (0, entries[name][1])
+                    if store is not None:
+                        store.put(name, 0, entries[name][1])
+    finally:
+        # 中断时也保存已完成文件的状态，否则下次会再旋转一遍
+        if os.path.exists(states_path) or store is None:
+            write_legacy_states(
+                (
+                    (name, angle, rects)
+                    for name, (angle, rects) in sorted(entries.items())
+                ),
+                states_path,
+            )
+        if store is not None:
+            store.close()
+    if failed:
+        print(f"{len(failed)} 个文件旋转失败，其余旋转已应用，angle 已清除。")
+    else:
+        print("所有旋转已应用，angle 已清除。")
+    return failed
 
 
 if __name__ == "__main__":
-    apply_rotation()
+    parser = argparse.ArgumentParser(description="把保存的旋转角度应用到原图")
+    parser.add_argument(
+        '--mode', choices=('auto', 'jpegtran', 'exif', 'reencode'), default='auto'
+    )
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+    if apply_rotation(mode=args.mode, workers=args.workers):
+        sys.exit(1)
@@ -1,10 +1,34 @@
+import argparse
 import os
+import queue
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
 
 import cv2
 import numpy as np
+from PIL import Image
+
+from src import perf
+from src.cli import add_output_options, dedup_from_args
+from src.image_state import list_images, load_image
+from src.manifest import load_manifest, save_manifest
+from src.pages import is_pdf, page_stem, split_page
+from src.phash import HashIndex, confirm_files, file_phash, index_key
+from src.watch import FolderWatcher
+from src.writer import (
+    CropWriter,
+    OutputFormat,
+    summarize,
+    write_report,
+)
 
 RAW_DIR = 'raw'
 OUTPUT_DIR = 'output'
+# 记录已处理文件的清单，用于中断后续跑
+MANIFEST_NAME = '.auto_split.json'
+# 批量分割默认用 PNG 压缩级别 1：与以前 cv2.imwrite 的默认级别相同，
+# 编码比级别 6 快数倍，是批量分割的主要耗时
+DEFAULT_FORMAT = OutputFormat('png', 1)
 
 
 def ensure_dir(path):
@@ -12,52 +36,491 @@ def ensure_dir(path):
         os.makedirs(path)
 
 
+def blank_mask(img, threshold=240):
+    """像素是否为空白（灰度大于 threshold）"""
+    gray = img if img.ndim == 2 else cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    return gray > threshold
+
+
+def find_runs(flags):
+    """一维布尔数组中连续 True 段的起点和终点（不含），全部向量化"""
+    padded = np.concatenate(([False], flags, [False])).astype(np.int8)
+    edges = np.diff(padded)
+    return np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+
+
+def _exact_row_blank(img, threshold, blank_ratio):
+    return blank_mask(img, threshold).sum(axis=1) > blank_ratio * img.shape[1]
+
+
+def _pooled_row_blank(mask, blank_ratio, scale):
+    """空白掩码（0/255）按 scale x scale 块求平均的缩小图上，各行是否为空白
+
+    掩码先用空白填充到整块，块内各行都是空白时块行的平均空白比例也超过
+    blank_ratio，所以全为空白的块行一定判为空白；反之不一定，需要再核对。
+    """
+    h, w = mask.shape
+    mask = cv2.copyMakeBorder(
+        mask, 0, -h % scale, 0, -w % scale, cv2.BORDER_CONSTANT, value=255
+    )
+    # 整数倍缩小时 INTER_AREA 即块内平均，结果取整最多差 0.5，阈值相应放宽
+    pooled = cv2.resize(
+        mask,
+        (mask.shape[1] // scale, mask.shape[0] // scale),
+        interpolation=cv2.INTER_AREA,
+    )
+    return pooled.mean(axis=1) > blank_ratio * 255 - 0.5
+
+
+def _coarse_row_blank(exact, coarse_blank, h, tolerance):
+    """按缩小图各行的空白判断找候选空白带，带内及边缘 tolerance 内用 exact 判断
+
+    exact(r0, r1) 返回全分辨率第 r0 到 r1 行是否为空白，
+    不在任何候选带附近的行都视为非空白。
+    """
+    fy = h / len(coarse_blank)
+    starts, ends = find_runs(coarse_blank)
+    if not len(starts):
+        return exact(0, h)
+    row_blank = np.zeros(h, dtype=bool)
+    for cs, ce in zip(starts, ends):
+        r0 = max(0, int(round(cs * fy)) - tolerance)
+        r1 = min(h, int(round(ce * fy)) + tolerance)
+        row_blank[r0:r1] = exact(r0, r1)
+    # 首尾两段空白决定切分的起止，缩小图可能漏掉很短的空白，首尾按全分辨率判断
+    head = min(h, int(round(starts[0] * fy)) + tolerance)
+    tail = max(0, int(round(ends[-1] * fy)) - tolerance)
+    row_blank[:head] = exact(0, head)
+    row_blank[tail:] = exact(tail, h)
+    return row_blank
+
+
+def split_regions_by_blank(
+    img,
+    min_blank_height=30,
+    threshold=240,
+    blank_ratio=0.98,
+    coarse_scale=None,
+    tolerance=None,
+    coarse=None,
+):
+    """按空白行横向分割，返回每个题目的区域 (x0, y0, x1, y1)
+
+    指定 coarse_scale 时先把空白掩码按块求平均缩小，在缩小图上找候选空白带，
+    再在带内及带边缘 tolerance 像素内按全分辨率判断，默认 tolerance 为 2 倍缩放比；
+    也可直接传入解码时缩小的灰度图 coarse，同样按全分辨率核对。
+    全为空白的块行一定落在候选带中，tolerance 不小于块高时，只有短于两个块高、
+    不含完整块行的空白段可能被漏掉，其余切线与精确模式一致。
+    """
+    h, w = img.shape[:2]
+    if coarse is None and coarse_scale and coarse_scale > 1:
+        gray = img if img.ndim == 2 else cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        _, mask = cv2.threshold(gray, threshold, 255, cv2.THRESH_BINARY)
+        coarse_blank = _pooled_row_blank(mask, blank_ratio, coarse_scale)
+
+        def exact(r0, r1):
+            return np.count_nonzero(mask[r0:r1], axis=1) > blank_ratio * w
+
+    elif coarse is not None:
+        coarse_blank = _exact_row_blank(coarse, threshold, blank_ratio)
+
+        def exact(r0, r1):
+            return _exact_row_blank(img[r0:r1], threshold, blank_ratio)
+
+    else:
+        coarse_blank = None
+    if coarse_blank is not None:
+        if tolerance is None:
+            tolerance = 2 * int(np.ceil(h / len(coarse_blank)))
+        row_blank = _coarse_row_blank(exact, coarse_blank, h, tolerance)
+    else:
+        row_blank = _exact_row_blank(img, threshold, blank_ratio)
+    starts, ends = find_runs(row_blank)
+    ends = ends - 1
+    # 每段空白的参考起点：第一段从 0 开始
+    lasts = starts.copy()
+    if len(lasts):
+        lasts[0] = 0
+    # 除最后一段外，足够长的空白段在其末尾切开
+    cuts = ends[:-1][(ends[:-1] - lasts[:-1]) > min_blank_height]
+    final_last = lasts[-1] if len(lasts) else 0
+    if h - final_last > min_blank_height:
+        cuts = np.append(cuts, h - 1)
+    # 相邻切线之间足够高的部分作为一题
+    prev = np.concatenate(([0], cuts[:-1]))
+    keep = (cuts - prev) > min_blank_height
+    return [(0, int(y0), w, int(y1)) for y0, y1 in zip(prev[keep], cuts[keep])]
+
+
+def _content_segments(blank, min_gap):
+    """被至少 min_gap 长的空白隔开的内容段 [(start, end)]"""
+    starts, ends = find_runs(~blank)
+    if not len(starts):
+        return []
+    breaks = np.flatnonzero(starts[1:] - ends[:-1] >= min_gap)
+    seg_starts = starts[np.concatenate(([0], breaks + 1))]
+    seg_ends = ends[np.concatenate((breaks, [len(ends) - 1]))]
+    return list(zip(seg_starts.tolist(), seg_ends.tolist()))
+
+
+def xy_cut(img, threshold=240, blank_ratio=0.98, min_gap=30, min_region=50):
+    """递归 XY-cut：交替按空白行、空白列切分，返回内容区域 (x0, y0, x1, y1)
+
+    min_gap 为切分所需的最小空白宽度，宽或高小于 min_region 的区域视为噪点丢弃。
+    """
+    blank = blank_mask(img, threshold)
+    boxes = []
+
+    def cut(x0, y0, x1, y1):
+        region = blank[y0:y1, x0:x1]
+        row_segs = _content_segments(region.mean(axis=1) > blank_ratio, min_gap)
+        col_segs = _content_segments(region.mean(axis=0) > blank_ratio, min_gap)
+        if not row_segs or not col_segs:
+            return
+        if len(row_segs) > 1:
+            for s, e in row_segs:
+                cut(x0, y0 + s, x1, y0 + e)
+        elif len(col_segs) > 1:
+            for s, e in col_segs:
+                cut(x0 + s, y0, x0 + e, y1)
+        else:
+            # 无法再切，去掉四周空白后作为一个区域
+            bx0, bx1 = x0 + col_segs[0][0], x0 + col_segs[0][1]
+            by0, by1 = y0 + row_segs[0][0], y0 + row_segs[0][1]
+            if bx1 - bx0 >= min_region and by1 - by0 >= min_region:
+                boxes.append((bx0, by0, bx1, by1))
+
+    cut(0, 0, img.shape[1], img.shape[0])
+    return boxes
+
+
 def split_image_by_blank(img, min_blank_height=30):
-    """按空白行分割图片，返回每个题目的图片列表"""
-    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-    _, thresh = cv2.threshold(gray, 240, 255, cv2.THRESH_BINARY)
-    # 统计每一行的白色像素数
-    row_sums = np.sum(thresh == 255, axis=1)
-    blank_rows = np.where(row_sums > 0.98 * img.shape[1])[0]
-
-    # 找到连续的空白行区间
-    splits = []
-    last = 0
-    for i in range(1, len(blank_rows)):
-        if blank_rows[i] - blank_rows[i - 1] > 1:
-            if blank_rows[i - 1] - last > min_blank_height:
-                splits.append((last, blank_rows[i - 1]))
-            last = blank_rows[i]
-    # 最后一段
-    if img.shape[0] - last > min_blank_height:
-        splits.append((last, img.shape[0] - 1))
-
-    # 分割图片
-    images = []
-    prev_end = 0
-    for start, end in splits:
-        if end - prev_end > min_blank_height:
-            crop = img[prev_end:end, :]
-            images.append(crop)
-        prev_end = end
-    return images
-
-
-def process_images():
-    ensure_dir(OUTPUT_DIR)
-    for fname in os.listdir(RAW_DIR):
-        if fname.lower().endswith(('.png', '.jpg', '.jpeg', '.bmp')):
-            img_path = os.path.join(RAW_DIR, fname)
+    """按空白行分割图片，返回每个题目的图片列表（原图的视图，不复制）"""
+    return [
+        img[y0:y1, x0:x1]
+        for x0, y0, x1, y1 in split_regions_by_blank(img, min_blank_height)
+    ]
+
+
+# JPEG 可在解码时按 DCT 缩小，直接得到缩小的灰度图
+_REDUCED_GRAYSCALE = {
+    2: cv2.IMREAD_REDUCED_GRAYSCALE_2,
+    4: cv2.IMREAD_REDUCED_GRAYSCALE_4,
+    8: cv2.IMREAD_REDUCED_GRAYSCALE_8,
+}
+
+
+def split_file(
+    img_path,
+    output_dir=OUTPUT_DIR,
+    mode='rows',
+    coarse_scale=None,
+    tolerance=None,
+    fmt=DEFAULT_FORMAT,
+    dedup=None,
+):
+    """读取、分割并写出单个文件，返回写出文件的 WriteResult，无法读取时返回 None"""
+    with perf.span('split.read'):
+        if split_page(img_path)[1] is not None or is_pdf(img_path):
+            # 多页文件只解码该页
+            try:
+                rgb = load_image(img_path).convert('RGB')
+            except OSError:
+                return None
+            img = cv2.cvtColor(np.asarray(rgb), cv2.COLOR_RGB2BGR)
+        else:
             img = cv2.imread(img_path)
-            if img is None:
+        if img is None:
+            return None
+        coarse = None
+        if (
+            mode != 'xycut'
+            and coarse_scale in _REDUCED_GRAYSCALE
+            and img_path.lower().endswith(('.jpg', '.jpeg'))
+        ):
+            coarse = cv2.imread(img_path, _REDUCED_GRAYSCALE[coarse_scale])
+    with perf.span('split.detect'):
+        if mode == 'xycut':
+            boxes = xy_cut(img)
+        else:
+            boxes = split_regions_by_blank(
+                img, coarse_scale=coarse_scale, tolerance=tolerance, coarse=coarse
+            )
+    stem = page_stem(img_path)
+    with CropWriter(output_dir, fmt, dedup=dedup) as writer:
+        for idx, (x0, y0, x1, y1) in enumerate(boxes):
+            crop = cv2.cvtColor(img[y0:y1, x0:x1], cv2.COLOR_BGR2RGB)
+            writer.submit(f"{stem}_q{idx+1}{fmt.extension}", Image.fromarray(crop))
+    return writer.close()
+
+
+def _source_key(path):
+    # 多页文件的各页以整个文件的大小和修改时间为准
+    st = os.stat(split_page(path)[0])
+    return [st.st_size, st.st_mtime_ns]
+
+
+def process_images(
+    mode='rows',
+    workers=None,
+    max_in_flight=None,
+    force=False,
+    raw_dir=RAW_DIR,
+    output_dir=OUTPUT_DIR,
+    coarse_scale=None,
+    tolerance=None,
+    watch=False,
+    settle=1.0,
+    fmt=DEFAULT_FORMAT,
+    report=None,
+    dedup=None,
+):
+    """多进程批量分割 raw_dir 下的图片
+
+    coarse_scale 启用先粗后精的空白检测，见 split_regions_by_blank。
+    fmt 为输出格式；report 给出路径时写出每张分割图片的字节数和编码耗时。
+
+    给出 dedup（phash.Dedup）时先在进程池中计算整页的感知哈希，与索引中
+    已处理的页面近似重复的按 dedup.mode 标出或跳过；分割图片也与索引中已有的
+    分割图片比较。页面按哈希结果返回的顺序逐个判断，批次内的重扫页也能发现。
+
+    结果按完成顺序写盘，已完成的文件记录在 output_dir 下的清单中，
+    中断后重新运行会跳过输入未变化且输出齐全的文件（force 强制重做）。
+
+    watch 为真时处理完已有文件后继续监视 raw_dir，新文件写完（settle 秒内
+    大小不变）后经有界队列送入进程池，直到 Ctrl+C。
+    """
+    ensure_dir(output_dir)
+    manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+    manifest = {} if force else load_manifest(manifest_path)
+    # 分割参数变化时需要重做
+    options = [mode, coarse_scale, tolerance, fmt.spec]
+
+    todo = []
+    skipped = 0
+    # 多页文件的每一页单独分割，名字为 '文件#页码'
+    fnames = list_images(raw_dir)
+    for fname in fnames:
+        source = _source_key(os.path.join(raw_dir, fname))
+        entry = manifest.get(fname)
+        if (
+            entry
+            and entry['source'] == source
+            and entry.get('options') == options
+            and all(
+                os.path.exists(os.path.join(output_dir, n)) for n in entry['outputs']
+            )
+        ):
+            skipped += 1
+            continue
+        todo.append((fname, source))
+
+    workers = workers or os.cpu_count() or 1
+    max_in_flight = max_in_flight or workers * 2
+    pages = duplicates = 0
+    written = []
+    index = None if dedup is None else HashIndex(dedup.path)
+    start = last_flush = time.perf_counter()
+    watcher = None
+    if watch:
+        # 已列出的文件由上面的清单逻辑处理，监视器只报告之后出现的文件
+        watcher = FolderWatcher(raw_dir, fnames, maxsize=max_in_flight, settle=settle)
+        watcher.start()
+        print(f"正在监视 {raw_dir}，按 Ctrl+C 停止")
+    executor = ProcessPoolExecutor(workers)
+    backlog = iter(todo)
+    pending = {}
+
+    def submit(fname, source):
+        path = os.path.join(raw_dir, fname)
+        # 工作进程的计时记录随结果带回
+        if index is not None:
+            future = executor.submit(perf.call_traced, file_phash, path)
+            pending[future] = ('hash', fname, source)
+            return
+        submit_split(fname, source)
+
+    def submit_split(fname, source):
+        future = executor.submit(
+            perf.call_traced,
+            split_file,
+            os.path.join(raw_dir, fname),
+            output_dir,
+            mode,
+            coarse_scale,
+            tolerance,
+            fmt,
+            dedup,
+        )
+        pending[future] = ('split', fname, source)
+
+    def check_page(fname, source, h):
+        """返回是否继续分割该页"""
+        key = index_key(raw_dir, fname)
+        hits = [name for name, _ in index.find('page', h, dedup.max_distance)]
+        # 哈希相近的候选再核对尺寸和像素
+        other = next(
+            (name for name in hits if name != key and confirm_files(key, name)), None
+        )
+        if other is None:
+            index.add('page', key, h)
+            return True
+        duplicate_of = os.path.relpath(other, raw_dir)
+        if not dedup.skip:
+            print(f"{fname} 与 {duplicate_of} 近似重复")
+            return True
+        print(f"{fname} 与 {duplicate_of} 近似重复，已跳过")
+        manifest[fname] = {
+            'source': source,
+            'options': options,
+            'outputs': [],
+            'duplicate_of': duplicate_of,
+        }
+        return False
+
+    def fill():
+        # 限制同时在途的任务数，避免一次性提交全部文件
+        while len(pending) < max_in_flight:
+            item = next(backlog, None)
+            if item is None and watcher is not None:
+                try:
+                    path = watcher.queue.get_nowait()
+                except queue.Empty:
+                    return
+                item = (os.path.basename(path), _source_key(path))
+            if item is None:
+                return
+            submit(*item)
+
+    try:
+        fill()
+        while pending or watcher is not None:
+            if not pending:
+                # 空闲时等待新文件
+                try:
+                    path = watcher.queue.get(timeout=1)
+                except queue.Empty:
+                    continue
+                submit(os.path.basename(path), _source_key(path))
                 continue
-            sub_imgs = split_image_by_blank(img)
-            for idx, sub_img in enumerate(sub_imgs):
-                out_name = f"{os.path.splitext(fname)[0]}_q{idx+1}.png"
-                out_path = os.path.join(OUTPUT_DIR, out_name)
-                cv2.imwrite(out_path, sub_img)
-            print(f"{fname} 分割为 {len(sub_imgs)} 题")
+            done, _ = wait(
+                pending,
+                timeout=None if watcher is None else 1,
+                return_when=FIRST_COMPLETED,
+            )
+            for future in done:
+                stage, fname, source = pending.pop(future)
+                try:
+                    results, events = future.result()
+                except OSError:
+                    # 计算哈希时无法读取的文件与 split_file 一样忽略
+                    if stage != 'hash':
+                        raise
+                    continue
+                perf.add_events(events)
+                if stage == 'hash':
+                    if check_page(fname, source, results):
+                        submit_split(fname, source)
+                    else:
+                        duplicates += 1
+                    continue
+                if results is None:
+                    continue
+                if index is not None:
+                    for r in results:
+                        if r.duplicate_of is None:
+                            index.add('crop', index_key(output_dir, r.name), r.phash)
+                    # 提交后之后开始的工作进程才能查到这些分割图片
+                    index.commit()
+                names = [r.name for r in results if not r.skipped]
+                # 本次输出更少时清理上次多出的文件
+                old = manifest.get(fname, {}).get('outputs', [])
+                for name in set(old) - set(names):
+                    try:
+                        os.remove(os.path.join(output_dir, name))
+                    except FileNotFoundError:
+                        pass
+                manifest[fname] = {
+                    'source': source,
+                    'options': options,
+                    'outputs': names,
+                }
+                pages += 1
+                written.extend(results)
+                print(f"{fname} 分割为 {len(names)} 题")
+            fill()
+            if time.perf_counter() - last_flush > 5:
+                save_manifest(manifest_path, manifest)
+                last_flush = time.perf_counter()
+    except KeyboardInterrupt:
+        if watcher is None:
+            raise
+        print("已停止监视")
+    finally:
+        if watcher is not None:
+            watcher.stop()
+        executor.shutdown(cancel_futures=True)
+        save_manifest(manifest_path, manifest)
+        if index is not None:
+            index.commit()
+            index.close()
+        if report:
+            write_report(report, written)
+
+    elapsed = time.perf_counter() - start
+    rate = 1 / elapsed if elapsed > 0 else 0.0
+    crops = sum(not r.skipped for r in written)
+    print(
+        f"完成 {pages} 页、{crops} 题，跳过 {skipped} 页，用时 {elapsed:.1f}s，"
+        f"{pages * rate:.2f} 页/s，{crops * rate:.2f} 题/s，{summarize(written)}"
+    )
+    if duplicates:
+        print(f"{duplicates} 页与已处理的页面近似重复，未分割")
 
 
 if __name__ == '__main__':
-    process_images()
+    parser = argparse.ArgumentParser(description="按空白分割 raw 下的图片")
+    parser.add_argument('--mode', choices=('rows', 'xycut'), default='rows')
+    parser.add_argument(
+        '--workers', type=int, default=None, help="进程数，默认 CPU 核数"
+    )
+    parser.add_argument(
+        '--max-in-flight', type=int, default=None, help="同时在途的最大任务数"
+    )
+    parser.add_argument('--force', action='store_true', help="忽略清单，全部重做")
+    parser.add_argument(
+        '--coarse',
+        type=int,
+        default=None,
+        help="先在按 N x N 块缩小的空白掩码上找空白带",
+    )
+    parser.add_argument(
+        '--tolerance', type=int, default=None, help="粗检测后精确定位的范围（像素）"
+    )
+    parser.add_argument(
+        '--watch', action='store_true', help="处理完后继续监视 raw 目录中的新文件"
+    )
+    parser.add_argument(
+        '--settle', type=float, default=1.0, help="文件大小保持不变多少秒后才处理"
+    )
+    add_output_options(
+        parser, "按感知哈希标出或跳过近似重复的页面和分割图片", DEFAULT_FORMAT
+    )
+    args = parser.parse_args()
+    if args.trace:
+        perf.enable()
+    process_images(
+        args.mode,
+        args.workers,
+        args.max_in_flight,
+        args.force,
+        coarse_scale=args.coarse,
+        tolerance=args.tolerance,
+        watch=args.watch,
+        settle=args.settle,
+        fmt=args.format,
+        report=args.report,
+        dedup=dedup_from_args(args),
+    )
+    if args.trace:
+        print(f"已写出 {perf.export_trace(args.trace)} 条计时记录到 {args.trace}")
@@ -0,0 +1,451 @@
+"""热点路径基准测试
+
+生成合成扫描页（尺寸、格式、空白密度、框数量可变），分别计时：
+启动、按倍数缩小解码、display_image（含旋转）、导出分割图片、状态保存/加载、
+split_image_by_blank 每百万像素耗时、apply_rotation。结果写成 JSON 便于对比。
+
+    python benchmarks/run_benchmarks.py --output bench.json [--quick] [--cases ...]
+
+GUI 相关用例在 Qt offscreen 平台下运行。
+"""
+
+import argparse
+import json
+import math
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import numpy as np  # noqa: E402
+from PIL import Image  # noqa: E402
+
+CASES = ('startup', 'decode', 'display', 'export', 'states', 'split', 'rotation')
+
+
+def make_page(width, height, blank_density, seed, speckle=0.0):
+    """白底上随机排布的深色文字块，blank_density 为空白行间距占比
+
+    speckle 为全页随机黑点（模拟扫描灰尘）的像素占比。
+    """
+    rng = np.random.default_rng(seed)
+    page = np.full((height, width, 3), 255, dtype=np.uint8)
+    y = int(rng.integers(0, 40))
+    while y < height:
+        block = int(rng.integers(40, 240))
+        gap = int(block * blank_density / max(1e-6, 1 - blank_density))
+        x0 = int(rng.integers(20, max(21, width // 10)))
+        x1 = width - int(rng.integers(20, max(21, width // 10)))
+        noise = rng.integers(0, 120, (min(block, height - y), x1 - x0, 1), np.uint8)
+        page[y : y + block, x0:x1] = noise
+        y += block + max(gap, 31)
+    if speckle:
+        page[rng.random((height, width)) < speckle] = 0
+    return Image.fromarray(page)
+
+
+def make_rects(size, count, seed):
+    rng = np.random.default_rng(seed)
+    w, h = size
+    rects = []
+    for _ in range(count):
+        rw, rh = int(rng.integers(50, w // 2)), int(rng.integers(50, h // 4))
+        x, y = int(rng.integers(0, w - rw)), int(rng.integers(0, h - rh))
+        rects.append((x, y, rw, rh))
+    return rects
+
+
+def write_pages(raw_dir, sizes, formats, blank_density, per_combo):
+    os.makedirs(raw_dir, exist_ok=True)
+    names = []
+    seed = 0
+    for width, height in sizes:
+        for fmt in formats:
+            for _ in range(per_combo):
+                name = f"page_{width}x{height}_{seed:04d}.{fmt}"
+                make_page(width, height, blank_density, seed).save(
+                    os.path.join(raw_dir, name)
+                )
+                names.append(name)
+                seed += 1
+    return names
+
+
+def measure(fn, repeat, setup=None):
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return {
+        'times': times,
+        'min': min(times),
+        'median': statistics.median(times),
+        'mean': statistics.fmean(times),
+    }
+
+
+def bench_startup(work, cfg, results):
+    from PySide6 import QtWidgets
+
+    import main
+
+    app = QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+    raw = os.path.join(work, 'raw')
+    template = os.path.join(raw, sorted(os.listdir(raw))[0])
+    # 大目录用硬链接/复制模拟，避免生成大量不同图片
+    big = os.path.join(work, 'startup')
+    os.makedirs(os.path.join(big, 'raw'), exist_ok=True)
+    ext = os.path.splitext(template)[1]
+    for i in range(cfg['startup_files']):
+        dst = os.path.join(big, 'raw', f"copy_{i:06d}{ext}")
+        if not os.path.exists(dst):
+            try:
+                os.link(template, dst)
+            except OSError:
+                shutil.copy(template, dst)
+    cwd = os.getcwd()
+    os.chdir(big)
+    try:
+
+        def start():
+            win = main.ImageSplitterApp()
+            app.processEvents()
+            win.close()
+
+        stats = measure(start, cfg['repeat'], setup=lambda: _remove(main.STATE_DB))
+    finally:
+        os.chdir(cwd)
+    results.append(
+        {'name': 'startup', 'params': {'files': cfg['startup_files']}, **stats}
+    )
+
+
+def _remove(path):
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+
+def bench_decode(work, cfg, results):
+    from src.image_state import load_image
+
+    # 另加奇数尺寸的页面，检查缩小后的尺寸为向上取整
+    odd = os.path.join(work, 'decode')
+    names = write_pages(odd, [(1001, 1501)], cfg['formats'], cfg['blank_density'], 1)
+    raw = os.path.join(work, 'raw')
+    paths = [os.path.join(raw, n) for n in sorted(os.listdir(raw))]
+    paths += [os.path.join(odd, n) for n in names]
+    for path in paths:
+        with Image.open(path) as img:
+            w, h = img.size
+        for factor in (1, 2, 4, 8):
+            size = load_image(path, factor).size
+            expected = (math.ceil(w / factor), math.ceil(h / factor))
+            assert size == expected, (path, factor, size, expected)
+            stats = measure(lambda: load_image(path, factor), cfg['repeat'])
+            results.append(
+                {
+                    'name': 'load_image',
+                    'params': {
+                        'file': os.path.basename(path),
+                        'size': [w, h],
+                        'factor': factor,
+                    },
+                    **stats,
+                }
+            )
+
+
+def bench_display(work, cfg, results):
+    from PySide6 import QtWidgets
+
+    import main
+
+    app = QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+    cwd = os.getcwd()
+    os.chdir(work)
+    try:
+        _remove(main.STATE_DB)
+        win = main.ImageSplitterApp()
+        win.show()
+        # 只测同步路径，关闭预取和后台建议框
+        win.prefetcher.ahead = win.prefetcher.behind = 0
+        win.suggest_act.setChecked(False)
+        win.proposer.shutdown()
+        for idx, state in enumerate(win.images):
+            for angle in (0, 90, 45):
+
+                def setup():
+                    win.pixmaps.clear()
+                    type(state).cache.clear()
+                    state.angle = angle
+                    win.cur_idx = idx
+
+                def show():
+                    win.display_image()
+                    app.processEvents()
+
+                stats = measure(show, cfg['repeat'], setup)
+                cached = measure(show, cfg['repeat'])
+                results.append(
+                    {
+                        'name': 'display_image',
+                        'params': {
+                            'file': os.path.basename(state.path),
+                            'size': list(state.size),
+                            'angle': angle,
+                        },
+                        **stats,
+                        'cached_median': cached['median'],
+                    }
+                )
+            state.angle = 0
+        win.close()
+    finally:
+        os.chdir(cwd)
+
+
+def bench_export(work, cfg, results):
+    from src.export import MANIFEST_NAME, export_crops
+    from src.image_state import image_size, rotated_size
+
+    raw = os.path.join(work, 'raw')
+    out = os.path.join(work, 'output')
+    jobs = []
+    for i, name in enumerate(sorted(os.listdir(raw))):
+        path = os.path.join(raw, name)
+        angle = (i % 4) * 90
+        size = rotated_size(image_size(path), angle)
+        jobs.append((path, angle, make_rects(size, cfg['rects'], i)))
+    crops = sum(len(rects) for _, _, rects in jobs)
+    for workers in cfg['export_workers']:
+        stats = measure(
+            lambda: export_crops(jobs, out, workers),
+            cfg['repeat'],
+            setup=lambda: shutil.rmtree(out, ignore_errors=True),
+        )
+        results.append(
+            {
+                'name': 'export_crops',
+                'params': {'images': len(jobs), 'crops': crops, 'workers': workers},
+                **stats,
+                'crops_per_s': crops / stats['median'],
+            }
+        )
+    # 清单命中时的增量导出
+    stats = measure(lambda: export_crops(jobs, out), cfg['repeat'])
+    assert os.path.exists(os.path.join(out, MANIFEST_NAME))
+    results.append(
+        {'name': 'export_crops_noop', 'params': {'images': len(jobs)}, **stats}
+    )
+
+
+def bench_states(work, cfg, results):
+    from src.image_state import ImageState
+    from src.state_store import StateStore
+
+    count = cfg['states']
+    states = []
+    for i in range(count):
+        state = ImageState(f"img_{i:06d}.png")
+        state.angle = (i % 4) * 90
+        state.rects = make_rects((2000, 3000), 1 + i % 8, i)
+        states.append(state)
+    txt = os.path.join(work, 'image_states.txt')
+    results.append(
+        {
+            'name': 'save_all',
+            'params': {'states': count},
+            **measure(lambda: ImageState.save_all(states, txt), cfg['repeat']),
+        }
+    )
+    results.append(
+        {
+            'name': 'load_all',
+            'params': {'states': count},
+            **measure(lambda: ImageState.load_all(states, txt), cfg['repeat']),
+        }
+    )
+    db = os.path.join(work, 'bench_states.db')
+    _remove(db)
+    store = StateStore(db)
+    results.append(
+        {
+            'name': 'store_save_full',
+            'params': {'states': count},
+            **measure(lambda: store.save(states), 1),
+        }
+    )
+
+    def touch_one():
+        states[count // 2].rects.append((1, 2, 3, 4))
+
+    results.append(
+        {
+            'name': 'store_save_one_changed',
+            'params': {'states': count},
+            **measure(lambda: store.save(states), cfg['repeat'], setup=touch_one),
+        }
+    )
+    results.append(
+        {
+            'name': 'store_load_into',
+            'params': {'states': count},
+            **measure(lambda: store.load_into(states), cfg['repeat']),
+        }
+    )
+    store.close()
+
+
+def bench_split(work, cfg, results):
+    import cv2
+
+    import auto_split
+
+    # 另加带灰尘黑点的页面，检查粗检测与精确模式的切分一致
+    speckled = os.path.join(work, 'speckled')
+    os.makedirs(speckled, exist_ok=True)
+    for i, speckle in enumerate((0.002, 0.01)):
+        make_page(2000, 3000, cfg['blank_density'], i, speckle).save(
+            os.path.join(speckled, f"speckled_{speckle}.png")
+        )
+    raw = os.path.join(work, 'raw')
+    paths = [os.path.join(raw, name) for name in sorted(os.listdir(raw))]
+    paths += [os.path.join(speckled, name) for name in sorted(os.listdir(speckled))]
+    for path in paths:
+        name = os.path.basename(path)
+        img = cv2.imread(path)
+        exact = auto_split.split_regions_by_blank(img)
+        for scale in (2, 4, 8):
+            coarse = auto_split.split_regions_by_blank(img, coarse_scale=scale)
+            assert coarse == exact, (name, scale, len(coarse), len(exact))
+        mpix = img.shape[0] * img.shape[1] / 1e6
+        for label, fn in (
+            ('rows', lambda: auto_split.split_regions_by_blank(img)),
+            ('coarse4', lambda: auto_split.split_regions_by_blank(img, coarse_scale=4)),
+            ('xycut', lambda: auto_split.xy_cut(img)),
+        ):
+            stats = measure(fn, cfg['repeat'])
+            results.append(
+                {
+                    'name': 'split_image_by_blank',
+                    'params': {'file': name, 'mode': label, 'megapixels': mpix},
+                    **stats,
+                    's_per_megapixel': stats['median'] / mpix,
+                }
+            )
+
+
+def bench_rotation(work, cfg, results):
+    from apply_rotation import rotate_file
+
+    raw = os.path.join(work, 'raw')
+    scratch = os.path.join(work, 'rotate')
+    for name in sorted(os.listdir(raw)):
+        for mode in ('auto', 'exif', 'reencode'):
+            if mode == 'exif' and not name.endswith('.jpg'):
+                continue
+            dst = os.path.join(scratch, name)
+
+            def setup():
+                os.makedirs(scratch, exist_ok=True)
+                shutil.copy(os.path.join(raw, name), dst)
+
+            stats = measure(lambda: rotate_file(dst, 90, mode), cfg['repeat'], setup)
+            results.append(
+                {
+                    'name': 'apply_rotation',
+                    'params': {'file': name, 'mode': mode},
+                    **stats,
+                }
+            )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--output', default='bench.json')
+    parser.add_argument('--quick', action='store_true', help="小规模快速运行")
+    parser.add_argument('--repeat', type=int, default=None)
+    parser.add_argument('--cases', nargs='+', choices=CASES, default=list(CASES))
+    parser.add_argument('--workdir', default=None, help="默认使用临时目录")
+    args = parser.parse_args(argv)
+
+    if args.quick:
+        cfg = {
+            'sizes': [(800, 1100)],
+            'formats': ['png', 'jpg'],
+            'per_combo': 1,
+            'startup_files': 500,
+            'states': 2000,
+            'rects': 5,
+            'export_workers': [1, 2],
+            'repeat': 2,
+        }
+    else:
+        cfg = {
+            'sizes': [(1700, 2300), (4900, 7000)],
+            'formats': ['png', 'jpg'],
+            'per_combo': 2,
+            'startup_files': 5000,
+            'states': 20000,
+            'rects': 20,
+            'export_workers': [1, os.cpu_count() or 1],
+            'repeat': 5,
+        }
+    if args.repeat:
+        cfg['repeat'] = args.repeat
+    cfg['blank_density'] = 0.3
+
+    work = args.workdir or tempfile.mkdtemp(prefix='imagesplitter-bench-')
+    write_pages(
+        os.path.join(work, 'raw'),
+        cfg['sizes'],
+        cfg['formats'],
+        cfg['blank_density'],
+        cfg['per_combo'],
+    )
+    results = []
+    runners = {
+        'startup': bench_startup,
+        'decode': bench_decode,
+        'display': bench_display,
+        'export': bench_export,
+        'states': bench_states,
+        'split': bench_split,
+        'rotation': bench_rotation,
+    }
+    for case in args.cases:
+        print(f"运行 {case}…", file=sys.stderr)
+        runners[case](work, cfg, results)
+
+    report = {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': sys.version,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'config': cfg,
+        },
+        'results': results,
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    if args.workdir is None:
+        shutil.rmtree(work, ignore_errors=True)
+    print(f"已写出 {len(results)} 条结果到 {args.output}", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+import argparse
+import os
+import sys
+
+from src import perf
+from src.cli import add_output_options, dedup_from_args
+from src.export import export_crops
+from src.image_state import read_legacy_states
+from src.pages import split_page
+from src.state_store import STATE_DB, StateStore
+from src.writer import summarize, write_report
+
+RAW_DIR = 'raw'
+OUTPUT_DIR = 'output'
+
+
+def load_jobs(states_path, raw_dir=RAW_DIR):
+    """从状态库或 image_states.txt 读取有框的图片，返回导出任务"""
+    if states_path.endswith('.txt'):
+        entries = read_legacy_states(states_path)
+        items = [(name, angle, rects) for name, (angle, rects) in entries.items()]
+    else:
+        store = StateStore(states_path)
+        items = list(store.items())
+        store.close()
+    jobs = []
+    for name, angle, rects in sorted(items):
+        path = os.path.join(raw_dir, name)
+        if not rects:
+            continue
+        if not os.path.exists(split_page(path)[0]):
+            print(f"未找到图片: {path}", file=sys.stderr)
+            continue
+        jobs.append((path, angle, rects))
+    return jobs
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="不启动界面，按保存的状态导出分割图片")
+    parser.add_argument(
+        '--states', default=STATE_DB, help="状态库或 image_states.txt 路径"
+    )
+    parser.add_argument('--raw', default=RAW_DIR)
+    parser.add_argument('--output', default=OUTPUT_DIR)
+    parser.add_argument('--workers', type=int, default=None)
+    add_output_options(parser, "按感知哈希标出或跳过与已导出图片近似重复的分割图片")
+    args = parser.parse_args(argv)
+    if not os.path.exists(args.states):
+        parser.error(f"{args.states} 不存在")
+    if args.trace:
+        perf.enable()
+
+    jobs = load_jobs(args.states, args.raw)
+
+    def progress(done, total):
+        print(f"\r{done}/{total}", end='', file=sys.stderr)
+        return True
+
+    dedup = dedup_from_args(args)
+    written, _ = export_crops(
+        jobs, args.output, args.workers, progress, args.format, dedup
+    )
+    print(file=sys.stderr)
+    count = sum(not r.skipped for r in written)
+    print(f"已导出 {count} 张分割图片到 {args.output}，{summarize(written)}")
+    if args.report:
+        write_report(args.report, written)
+    if args.trace:
+        print(f"已写出 {perf.export_trace(args.trace)} 条计时记录到 {args.trace}")
+
+
+if __name__ == '__main__':
+    main()
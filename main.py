@@ -1,25 +1,61 @@
 import os
+import queue
+from collections.abc import Callable
 
 from PySide6 import QtCore, QtGui, QtWidgets
 
-from src.image_state import ImageState
+from auto_split import split_regions_by_blank
+from src import perf
+from src.display import pixmap_nbytes, render_pixmap
+from src.export import export_crops
+from src.filmstrip import Filmstrip, ThumbnailModel
+from src.image_cache import ImageCache
+from src.image_state import ImageState, Rect, list_images, reduce_factor
+from src.perf_overlay import PerfOverlay
+from src.phash import Dedup
+from src.prefetch import Prefetcher
+from src.proposals import Proposer
+from src.rect_store import iou
+from src.state_store import STATE_DB, StateStore
+from src.tiles import TiledImageItem, needs_tiling
+from src.watch import FolderWatcher
 
 RAW_DIR = 'raw'
 
 
+def to_rect(rect: QtCore.QRectF) -> Rect:
+    return int(rect.x()), int(rect.y()), int(rect.width()), int(rect.height())
+
+
 class RectItem(QtWidgets.QGraphicsRectItem):
     HANDLE_SIZE = 16
 
     def __init__(
-        self, rect: QtCore.QRectF | QtCore.QRect, parent: 'ImageState | None' = None
+        self,
+        rect: QtCore.QRectF | QtCore.QRect,
+        state: ImageState | None = None,
+        rect_id: int | None = None,
     ):
+        # 形状缓存，几何变化时由 setRect 清除
+        self._shape: QtGui.QPainterPath | None = None
         super().__init__(rect)
         self.setAcceptHoverEvents(True)
-        self._parent = parent
+        # 位于建议框之上，重叠时优先响应
+        self.setZValue(1)
+        # 所属图片及框在其 RectStore 中的 id
+        self._state = state
+        self.rect_id = rect_id
         self._resizing = False
         self._resizeDir = None
 
+    def setRect(self, rect: QtCore.QRectF):
+        self._shape = None
+        super().setRect(rect)
+
     def shape(self):
+        # 悬停时会频繁调用，几何不变时复用
+        if self._shape is not None:
+            return self._shape
         # 只让边框区域响应鼠标事件
         path = QtGui.QPainterPath()
         rect = self.rect()
@@ -31,6 +67,7 @@ class RectItem(QtWidgets.QGraphicsRectItem):
             path_inner = QtGui.QPainterPath()
             path_inner.addRect(inner)
             path = path.subtracted(path_inner)
+        self._shape = path
         return path
 
     def hoverMoveEvent(self, event: QtWidgets.QGraphicsSceneHoverEvent):
@@ -86,14 +123,45 @@ class RectItem(QtWidgets.QGraphicsRectItem):
     def mouseReleaseEvent(self, event: QtWidgets.QGraphicsSceneMouseEvent):
         if not self._resizing:
             super().mouseReleaseEvent(event)
+        elif self._state is not None:
+            # 按 id 更新，相同的框或未调整大小时也不会改错
+            self._state.rects.update(self.rect_id, to_rect(self.rect()))
         self._resizing = False
         event.accept()
-        if self._parent:
-            self._parent.rects.remove(self._origRect)
-            self._parent.rects.append(self.rect())
+
+
+class SuggestionItem(QtWidgets.QGraphicsRectItem):
+    """自动分割给出的建议框，单击即转为可调整的正式框"""
+
+    def __init__(self, rect: Rect, accept: Callable[['SuggestionItem'], None]):
+        super().__init__(QtCore.QRectF(*rect))
+        self.suggested = rect
+        self._accept = accept
+        pen = QtGui.QPen(QtGui.QColor("#2e9d5b"), 2, QtCore.Qt.PenStyle.DashLine)
+        pen.setCosmetic(True)
+        self.setPen(pen)
+        self.setBrush(QtGui.QColor(46, 157, 91, 40))
+        self.setCursor(QtCore.Qt.CursorShape.PointingHandCursor)
+
+    def mousePressEvent(self, event: QtWidgets.QGraphicsSceneMouseEvent):
+        if event.button() == QtCore.Qt.MouseButton.LeftButton:
+            event.accept()
+        else:
+            super().mousePressEvent(event)
+
+    def mouseReleaseEvent(self, event: QtWidgets.QGraphicsSceneMouseEvent):
+        if event.button() == QtCore.Qt.MouseButton.LeftButton and self.contains(
+            event.pos()
+        ):
+            self._accept(self)
+        else:
+            super().mouseReleaseEvent(event)
 
 
 class ImageView(QtWidgets.QGraphicsView):
+    # 滚轮缩放后发出，用于按需切换显示分辨率
+    zoomed = QtCore.Signal()
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self._empty = True
@@ -109,6 +177,7 @@ class ImageView(QtWidgets.QGraphicsView):
         else:
             factor = 0.8
         self.scale(factor, factor)
+        self.zoomed.emit()
 
     def mousePressEvent(self, event: QtGui.QMouseEvent):
         if event.button() == QtCore.Qt.MouseButton.LeftButton:
@@ -143,18 +212,67 @@ class ImageSplitterApp(QtWidgets.QMainWindow):
         # 设置主窗口背景色
         self.setStyleSheet("QMainWindow { background: #f7f7fa; }")
 
+        # 多页 TIFF/PDF 的每一页是一张图片
         self.images = [
-            ImageState(os.path.join(RAW_DIR, f))
-            for f in sorted(os.listdir(RAW_DIR))
-            if f.lower().endswith(('.png', '.jpg', '.jpeg', '.bmp'))
+            ImageState(os.path.join(RAW_DIR, name)) for name in list_images(RAW_DIR)
         ]
+        # 自动恢复上次的状态，并定时保存有变化的图片
+        self.store = StateStore(STATE_DB)
+        self.store.load_into(self.images)
+        self.autosave_timer = QtCore.QTimer(self)
+        self.autosave_timer.timeout.connect(self.autosave)
+        self.autosave_timer.start(3000)
+        # 监视 raw 目录，扫描仪新写完的图片直接追加到列表末尾
+        self.watcher = FolderWatcher(
+            RAW_DIR, (os.path.basename(state.path) for state in self.images)
+        )
+        self.watcher.start()
+        self.ingest_timer = QtCore.QTimer(self)
+        self.ingest_timer.timeout.connect(self.ingest_new_images)
+        self.ingest_timer.start(500)
+
+        # 按 (路径, 角度, 缩小倍数) 缓存旋转后的显示帧
+        self.pixmaps = ImageCache(256 * 1024 * 1024, nbytes=pixmap_nbytes)
+        # 当前显示帧的缩小倍数，放大到看不清时换成更高分辨率
+        self.cur_factor = 1
+        # 后台预取前后几张图片，翻页时直接命中缓存
+        self.prefetcher = Prefetcher(
+            self.pixmaps,
+            ahead=2,
+            behind=1,
+            factor_for=self.display_factor,
+            parent=self,
+        )
 
         self.scene = QtWidgets.QGraphicsScene()
+        self.pixmap_item = self.scene.addPixmap(QtGui.QPixmap())
+        # 超大图片用分块金字塔显示，两者同一时间只有一个有内容
+        self.tiled_item = TiledImageItem()
+        self.scene.addItem(self.tiled_item)
+        # 当前图片的框项，按框 id 索引
+        self.rect_items: dict[int, RectItem] = {}
+        # 后台按空白分割当前及后面几张图片，结果显示为建议框
+        self.proposer = Proposer(split_regions_by_blank, parent=self)
+        self.proposer.ready.connect(self.on_proposals)
+        self.suggestion_items: list[SuggestionItem] = []
         self.img_view = ImageView(self.scene)
+        self.img_view.zoomed.connect(self.on_zoom)
         # 设置QGraphicsView背景色
         self.img_view.setBackgroundBrush(QtGui.QColor("#e6e6ed"))
         self.setCentralWidget(self.img_view)
 
+        # 左侧缩略图列表，可直接跳到任意一页
+        self.thumb_model = ThumbnailModel(self.images, parent=self)
+        self.filmstrip = Filmstrip(self.thumb_model)
+        self.filmstrip.page_selected.connect(self.go_to_image)
+        thumb_dock = QtWidgets.QDockWidget("缩略图", self)
+        thumb_dock.setObjectName("thumbnails")
+        thumb_dock.setFeatures(
+            QtWidgets.QDockWidget.DockWidgetFeature.NoDockWidgetFeatures
+        )
+        thumb_dock.setWidget(self.filmstrip)
+        self.addDockWidget(QtCore.Qt.DockWidgetArea.LeftDockWidgetArea, thumb_dock)
+
         # 美化工具栏
         toolbar = QtWidgets.QToolBar()
         toolbar.setMovable(False)
@@ -200,6 +318,10 @@ class ImageSplitterApp(QtWidgets.QMainWindow):
         crop_act = QtGui.QAction(
             QtGui.QIcon.fromTheme("edit-cut"), "保存分割图片", self
         )
+        self.suggest_act = QtGui.QAction("显示建议", self)
+        self.suggest_act.setCheckable(True)
+        self.suggest_act.setChecked(True)
+        accept_act = QtGui.QAction("接受全部建议", self)
 
         prev_act.triggered.connect(self.prev_image)
         next_act.triggered.connect(self.next_image)
@@ -207,6 +329,8 @@ class ImageSplitterApp(QtWidgets.QMainWindow):
         load_act.triggered.connect(self.load_states)
         save_act.triggered.connect(self.save_states)
         crop_act.triggered.connect(self.save_crops)
+        self.suggest_act.toggled.connect(self.on_suggest_toggled)
+        accept_act.triggered.connect(self.accept_all_suggestions)
 
         toolbar.addAction(prev_act)
         toolbar.addAction(next_act)
@@ -216,8 +340,22 @@ class ImageSplitterApp(QtWidgets.QMainWindow):
         toolbar.addAction(load_act)
         toolbar.addAction(save_act)
         toolbar.addSeparator()
+        toolbar.addAction(self.suggest_act)
+        toolbar.addAction(accept_act)
+        toolbar.addSeparator()
         toolbar.addAction(crop_act)
 
+        # 开启计时时在状态栏显示各阶段耗时，并可导出 trace
+        if perf.enabled:
+            self.perf_overlay = PerfOverlay(
+                {"解码缓存": ImageState.cache, "显示缓存": self.pixmaps}
+            )
+            self.statusBar().addPermanentWidget(self.perf_overlay, 1)
+            trace_act = QtGui.QAction("导出性能追踪", self)
+            trace_act.triggered.connect(self.export_trace)
+            toolbar.addSeparator()
+            toolbar.addAction(trace_act)
+
         self.img_view.setMouseTracking(True)
         self.img_view.viewport().installEventFilter(self)
         self.drawing = False
@@ -231,45 +369,156 @@ class ImageSplitterApp(QtWidgets.QMainWindow):
         return self.images[self.cur_idx]
 
     def display_image(self):
-        img = self.cur_image.get_display_image().convert("RGBA")
-        data = img.tobytes("raw", "RGBA")
-        qimg = QtGui.QImage(
-            data, img.width, img.height, QtGui.QImage.Format.Format_RGBA8888
-        )
-        pixmap = QtGui.QPixmap.fromImage(qimg)
-        self.scene.clear()
-        self.scene.addPixmap(pixmap)
-        self.img_view.setSceneRect(QtCore.QRectF(pixmap.rect()))
-        # 添加所有框
-        for rect in self.cur_image.rects:
-            self.scene.addItem(RectItem(rect, self.cur_image))
+        if not self.images:
+            return
+        with perf.span('display_image'):
+            self._display_image()
+        self.filmstrip.select_row(self.cur_idx)
+        self.show_suggestions()
+        self.prefetcher.schedule(self.images, self.cur_idx)
+        self.schedule_proposals()
+
+    def _display_image(self):
+        state = self.cur_image
+        tiled = needs_tiling(state)
+        if tiled:
+            self.pixmap_item.setPixmap(QtGui.QPixmap())
+            self.tiled_item.set_state(state)
+            self.cur_factor = 1
+        else:
+            self.tiled_item.set_state(None)
+        # 场景坐标始终是全分辨率坐标，不需要先解码
+        self.img_view.setSceneRect(QtCore.QRectF(0, 0, *state.display_size))
+        # 替换所有框
+        with perf.span('scene_rebuild'):
+            for item in self.rect_items.values():
+                self.scene.removeItem(item)
+            self.rect_items = {}
+            for rect_id, _ in state.rects.items():
+                self.add_rect_item(rect_id)
         # 优雅地恢复状态：只有transform和center都为None时才自适应
-        if self.cur_image.transform is not None and self.cur_image.center is not None:
-            self.img_view.setTransform(self.cur_image.transform)
-            self.img_view.centerOn(self.cur_image.center)
+        if state.transform is not None and state.center is not None:
+            self.img_view.setTransform(state.transform)
+            self.img_view.centerOn(state.center)
         else:
             self.img_view.reset_zoom()
             self.img_view.fitInView(
-                self.scene.sceneRect(), QtCore.Qt.AspectRatioMode.KeepAspectRatio
+                self.img_view.sceneRect(), QtCore.Qt.AspectRatioMode.KeepAspectRatio
             )
             # 保存自适应后的transform和center，避免下次再自适应
-            self.cur_image.transform = self.img_view.transform()
-            self.cur_image.center = self.img_view.mapToScene(
+            state.transform = self.img_view.transform()
+            state.center = self.img_view.mapToScene(
                 self.img_view.viewport().rect().center()
             )
+        # 视图缩放确定后再按需要的分辨率解码
+        if not tiled:
+            self.set_display_pixmap(state, self.display_factor(state))
+
+    def display_factor(self, state: ImageState) -> int:
+        """按图片保存的或自适应后的视图缩放选择显示用的缩小倍数"""
+        if state.transform is not None:
+            scale = state.transform.m11()
+        else:
+            w, h = state.display_size
+            view = self.img_view.viewport().rect()
+            scale = min(view.width() / w, view.height() / h)
+        return reduce_factor(scale * self.img_view.devicePixelRatioF())
+
+    def set_display_pixmap(self, state: ImageState, factor: int):
+        pixmap = self.pixmaps.get(
+            (state.path, state.angle, factor), lambda: render_pixmap(state, factor)
+        )
+        # 复用同一个 pixmap 项，只替换图片；缩小图放大回原图尺寸，框坐标不受影响
+        self.pixmap_item.setPixmap(pixmap)
+        self.pixmap_item.setScale(state.display_size[0] / max(1, pixmap.width()))
+        self.cur_factor = factor
+
+    def on_zoom(self):
+        if not self.images:
+            return
+        state = self.cur_image
+        if needs_tiling(state):
+            return
+        factor = reduce_factor(
+            self.img_view.transform().m11() * self.img_view.devicePixelRatioF()
+        )
+        # 只在放大时提高分辨率，缩小时继续用已有的清晰帧
+        if factor < self.cur_factor:
+            self.set_display_pixmap(state, factor)
+
+    def add_rect_item(self, rect_id: int):
+        state = self.cur_image
+        item = RectItem(QtCore.QRectF(*state.rects.get(rect_id)), state, rect_id)
+        self.scene.addItem(item)
+        self.rect_items[rect_id] = item
+
+    def remove_rect_item(self, rect_id: int):
+        item = self.rect_items.pop(rect_id, None)
+        if item is not None:
+            self.scene.removeItem(item)
+
+    def schedule_proposals(self):
+        # 关闭建议时不在后台分割
+        if self.suggest_act.isChecked():
+            self.proposer.schedule(self.images, self.cur_idx)
+
+    def on_suggest_toggled(self, checked: bool):
+        if checked and self.images:
+            self.schedule_proposals()
+        self.show_suggestions()
+
+    def on_proposals(self, key: tuple, rects: list[Rect]):
+        if not self.images:
+            return
+        if key == (self.cur_image.path, self.cur_image.angle):
+            self.show_suggestions()
+
+    def show_suggestions(self):
+        for item in self.suggestion_items:
+            self.scene.removeItem(item)
+        self.suggestion_items = []
+        if not self.images:
+            return
+        state = self.cur_image
+        rects = self.proposer.get(state)
+        if not rects or not self.suggest_act.isChecked():
+            return
+        for rect in rects:
+            # 已有相近的框时不再建议
+            if any(
+                iou(rect, state.rects.get(rect_id)) > 0.5
+                for rect_id in state.rects.overlapping(rect)
+            ):
+                continue
+            item = SuggestionItem(rect, self.accept_suggestion)
+            self.scene.addItem(item)
+            self.suggestion_items.append(item)
+
+    def accept_suggestion(self, item: SuggestionItem):
+        self.scene.removeItem(item)
+        self.suggestion_items.remove(item)
+        self.add_rect_item(self.cur_image.rects.add(item.suggested))
+        self.thumb_model.refresh(self.cur_idx)
+
+    def accept_all_suggestions(self):
+        for item in list(self.suggestion_items):
+            self.accept_suggestion(item)
 
     def save_current_state(self):
+        if not self.images:
+            return
         # 保存当前图片的缩放、中心、框
         self.cur_image.transform = self.img_view.transform()
         self.cur_image.center = self.img_view.mapToScene(
             self.img_view.viewport().rect().center()
         )
-        # 框
-        self.cur_image.rects = [
-            rect_item.rect()
-            for rect_item in self.scene.items()
-            if isinstance(rect_item, RectItem)
-        ]
+        # 框在编辑时已按 id 同步到 cur_image.rects
+        self.store.save([self.cur_image])
+        self.thumb_model.refresh(self.cur_idx)
+
+    def autosave(self):
+        if self.images:
+            self.store.save([self.cur_image])
 
     def prev_image(self):
         self.save_current_state()
@@ -283,13 +532,48 @@ class ImageSplitterApp(QtWidgets.QMainWindow):
             self.cur_idx += 1
             self.display_image()
 
+    def ingest_new_images(self):
+        new = []
+        while True:
+            try:
+                new.append(ImageState(self.watcher.queue.get_nowait()))
+            except queue.Empty:
+                break
+        if not new:
+            return
+        self.store.load_into(new)
+        was_empty = not self.images
+        # 追加到末尾，不打乱当前序号
+        self.thumb_model.append(new)
+        if was_empty:
+            self.display_image()
+        else:
+            self.prefetcher.schedule(self.images, self.cur_idx)
+            self.schedule_proposals()
+        self.statusBar().showMessage(f"新增 {len(new)} 张图片", 3000)
+
+    def go_to_image(self, idx: int):
+        if idx == self.cur_idx:
+            return
+        self.save_current_state()
+        self.cur_idx = idx
+        self.display_image()
+
     def rotate_image(self):
+        if not self.images:
+            return
+        self.pixmaps.discard(
+            (self.cur_image.path, self.cur_image.angle, self.cur_factor)
+        )
         self.cur_image.angle = (self.cur_image.angle + 90) % 360
+        self.store.save([self.cur_image])
+        self.thumb_model.refresh(self.cur_idx)
         self.display_image()
 
     def save_states(self):
         save_path = os.path.join("image_states.txt")
-        ImageState.save_all(self.images, save_path)
+        self.store.save(self.images)
+        self.store.export_legacy(save_path)
         QtWidgets.QMessageBox.information(
             self, "保存成功", "所有图片的状态已保存到 image_states.txt"
         )
@@ -299,39 +583,68 @@ class ImageSplitterApp(QtWidgets.QMainWindow):
         if not os.path.exists(state_path):
             QtWidgets.QMessageBox.warning(self, "未找到", "image_states.txt 文件不存在")
             return
-        success = ImageState.load_all(self.images, state_path)
-        if success:
-            self.display_image()
-            QtWidgets.QMessageBox.information(
-                self, "加载成功", "图片状态已从 image_states.txt 加载"
-            )
+        try:
+            self.store.import_legacy(state_path)
+        except ValueError as e:
+            QtWidgets.QMessageBox.warning(self, "加载失败", str(e))
+            return
+        self.store.load_into(self.images)
+        self.thumb_model.refresh()
+        self.display_image()
+        QtWidgets.QMessageBox.information(
+            self, "加载成功", "图片状态已从 image_states.txt 加载"
+        )
 
     def save_crops(self):
-        os.makedirs("output", exist_ok=True)
-        all_saved_rects = set()
-        for img_state in self.images:
-            img = img_state.get_display_image()
-            img_name = os.path.basename(img_state.path)
-            w_img, h_img = img.size
-            for rect in img_state.rects:
-                x, y, w_rect, h_rect = rect.x(), rect.y(), rect.width(), rect.height()
-                x0 = max(0, int(x))
-                y0 = max(0, int(y))
-                x1 = min(w_img, int(x + w_rect))
-                y1 = min(h_img, int(y + h_rect))
-                if x1 <= x0 or y1 <= y0:
-                    raise ValueError(
-                        f"Invalid rectangle for image {img_name}: ({x0}, {y0}, {x1}, {y1})"
-                    )
-                rect_key = (img_name, x0, y0, x1, y1)
-                if rect_key in all_saved_rects:
-                    continue
-                all_saved_rects.add(rect_key)
-                cropped = img.crop((x0, y0, x1, y1))
-                out_name = f"{os.path.splitext(img_name)[0]}_{x0}_{y0}_{x1}_{y1}.png"
-                cropped.save(os.path.join("output", out_name))
+        # 没有框的图片不需要解码
+        jobs = [
+            (img_state.path, img_state.angle, list(img_state.rects))
+            for img_state in self.images
+            if img_state.rects
+        ]
+        dialog = QtWidgets.QProgressDialog(
+            "正在保存分割图片…", "取消", 0, len(jobs), self
+        )
+        dialog.setWindowModality(QtCore.Qt.WindowModality.WindowModal)
+        dialog.setMinimumDuration(500)
+
+        def progress(done: int, total: int) -> bool:
+            dialog.setMaximum(total)
+            dialog.setValue(done)
+            QtWidgets.QApplication.processEvents()
+            return not dialog.wasCanceled()
+
+        try:
+            with perf.span('save_crops'):
+                # 照常写出，只标出与已导出图片近似重复的分割图片
+                results, finished = export_crops(
+                    jobs, "output", progress=progress, dedup=Dedup(mode='flag')
+                )
+        finally:
+            dialog.close()
+        if not finished:
+            QtWidgets.QMessageBox.information(self, "已取消", "分割图片保存已取消")
+            return
+        message = "所有分割图片已保存到output文件夹"
+        duplicates = [r for r in results if r.duplicate_of is not None]
+        if duplicates:
+            examples = "\n".join(
+                f"{r.name} ≈ {r.duplicate_of}" for r in duplicates[:10]
+            )
+            message += (
+                f"\n\n其中 {len(duplicates)} 张与已导出的图片近似重复：\n{examples}"
+            )
+        QtWidgets.QMessageBox.information(self, "保存成功", message)
+
+    def export_trace(self):
+        path, _ = QtWidgets.QFileDialog.getSaveFileName(
+            self, "导出性能追踪", "perf_trace.json", "Chrome trace (*.json)"
+        )
+        if not path:
+            return
+        count = perf.export_trace(path)
         QtWidgets.QMessageBox.information(
-            self, "保存成功", "所有分割图片已保存到output文件夹"
+            self, "导出成功", f"已写出 {count} 条计时记录，可用 chrome://tracing 打开"
         )
 
     def eventFilter(self, object: QtCore.QObject, event: QtCore.QEvent) -> bool:
@@ -344,6 +657,7 @@ class ImageSplitterApp(QtWidgets.QMainWindow):
             if (
                 event.button() == QtCore.Qt.MouseButton.LeftButton
                 and event.modifiers() & QtCore.Qt.KeyboardModifier.ControlModifier
+                and self.images
             ):
                 self.drawing = True
                 self.start = self.img_view.mapToScene(event.position().toPoint())
@@ -367,37 +681,41 @@ class ImageSplitterApp(QtWidgets.QMainWindow):
             if self.drawing and self.temp_rect:
                 end = self.img_view.mapToScene(event.position().toPoint())
                 rect = QtCore.QRectF(self.start, end).normalized()
-                if rect.width() > 10 and rect.height() > 10:
-                    self.cur_image.rects.append(rect)
                 self.scene.removeItem(self.temp_rect)
+                if rect.width() > 10 and rect.height() > 10:
+                    self.add_rect_item(self.cur_image.rects.add(to_rect(rect)))
+                    self.thumb_model.refresh(self.cur_idx)
                 self.temp_rect = None
                 self.drawing = False
                 self.img_view.setDragMode(
                     QtWidgets.QGraphicsView.DragMode.ScrollHandDrag
                 )
-                # 先保存当前缩放和中心
-                self.cur_image.transform = self.img_view.transform()
-                self.cur_image.center = self.img_view.mapToScene(
-                    self.img_view.viewport().rect().center()
-                )
-                self.display_image()
                 return True
         return super().eventFilter(object, event)
 
+    def closeEvent(self, event: QtGui.QCloseEvent):
+        self.save_current_state()
+        self.watcher.stop()
+        self.store.close()
+        # 等待后台任务结束，避免其回调已销毁的对象
+        self.prefetcher.shutdown()
+        self.tiled_item.shutdown()
+        self.thumb_model.shutdown()
+        self.proposer.shutdown()
+        super().closeEvent(event)
+
     def keyPressEvent(self, event: QtGui.QKeyEvent):
         # Ctrl+Z 撤销上一步框选
         if (
             event.modifiers() & QtCore.Qt.KeyboardModifier.ControlModifier
             and event.key() == QtCore.Qt.Key.Key_Z
         ):
+            if not self.images:
+                return
             if self.cur_image.rects:
-                self.cur_image.rects.pop()
-                # 先保存当前缩放和中心
-                self.cur_image.transform = self.img_view.transform()
-                self.cur_image.center = self.img_view.mapToScene(
-                    self.img_view.viewport().rect().center()
-                )
-                self.display_image()
+                rect_id, _ = self.cur_image.rects.pop()
+                self.remove_rect_item(rect_id)
+                self.thumb_model.refresh(self.cur_idx)
         else:
             super().keyPressEvent(event)
 
@@ -405,6 +723,10 @@ class ImageSplitterApp(QtWidgets.QMainWindow):
 if __name__ == "__main__":
     import sys
 
+    # --perf 与环境变量 IMAGESPLITTER_PERF=1 等效
+    if "--perf" in sys.argv:
+        sys.argv.remove("--perf")
+        perf.enable()
     app = QtWidgets.QApplication(sys.argv)
     win = ImageSplitterApp()
     win.show()
@@ -0,0 +1,40 @@
+"""命令行脚本共用的输出选项"""
+
+import argparse
+
+from src.phash import HASH_DB, Dedup
+from src.writer import OutputFormat, format_help, parse_format
+
+
+def add_output_options(
+    parser: argparse.ArgumentParser,
+    dedup_help: str,
+    default_format: OutputFormat = OutputFormat(),
+):
+    """添加 --format、--report、--dedup、--max-distance、--hash-db、--trace"""
+    parser.add_argument(
+        '--format', type=parse_format, default=default_format, help=format_help()
+    )
+    parser.add_argument(
+        '--report', default=None, help="写出每张分割图片字节数和编码耗时的 CSV"
+    )
+    parser.add_argument(
+        '--dedup', choices=('flag', 'skip'), default=None, help=dedup_help
+    )
+    parser.add_argument(
+        '--max-distance',
+        type=int,
+        default=Dedup._field_defaults['max_distance'],
+        help="哈希距离不超过该值的作为候选，再核对像素",
+    )
+    parser.add_argument('--hash-db', default=HASH_DB, help="感知哈希索引路径")
+    parser.add_argument(
+        '--trace', default=None, help="记录各阶段耗时并写出 Chrome trace 文件"
+    )
+
+
+def dedup_from_args(args: argparse.Namespace) -> Dedup | None:
+    """未指定 --dedup 时为 None"""
+    if args.dedup is None:
+        return None
+    return Dedup(args.hash_db, args.dedup, args.max_distance)
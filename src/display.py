@@ -0,0 +1,40 @@
+from PIL import Image
+from PySide6 import QtGui
+
+from src import perf
+from src.image_state import ImageState
+
+# PIL 模式到可直接引用其内存的 QImage 格式
+_QIMAGE_FORMATS = {
+    'L': QtGui.QImage.Format.Format_Grayscale8,
+    'RGB': QtGui.QImage.Format.Format_RGB888,
+    'RGBA': QtGui.QImage.Format.Format_RGBA8888,
+}
+
+
+def pixmap_nbytes(pixmap: QtGui.QPixmap) -> int:
+    return pixmap.width() * pixmap.height() * max(pixmap.depth(), 8) // 8
+
+
+def pil_to_qimage(img: Image.Image) -> tuple[QtGui.QImage, bytes]:
+    """PIL 图片转 QImage，返回 QImage 及其底层缓冲区
+
+    QImage 直接引用缓冲区而不复制，调用方需在 QImage 使用期间持有缓冲区。
+    L/RGB/RGBA 无需先转换为 RGBA，省去一次整帧复制。
+    """
+    with perf.span('to_qimage'):
+        if img.mode not in _QIMAGE_FORMATS:
+            img = img.convert('RGBA')
+        data = img.tobytes()
+        bytes_per_line = len(data) // img.height if img.height else 0
+        qimg = QtGui.QImage(
+            data, img.width, img.height, bytes_per_line, _QIMAGE_FORMATS[img.mode]
+        )
+    return qimg, data
+
+
+def render_pixmap(state: ImageState, factor: int = 1) -> QtGui.QPixmap:
+    qimg, _data = pil_to_qimage(state.get_display_image(factor))
+    # fromImage 会复制像素，_data 需存活到此处
+    with perf.span('pixmap_upload'):
+        return QtGui.QPixmap.fromImage(qimg)
@@ -0,0 +1,220 @@
+import multiprocessing
+import os
+from collections.abc import Callable
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from pathlib import Path
+
+from PIL import Image
+
+from src import perf
+from src.image_state import image_size, load_image, rotate_image, rotated_size
+from src.manifest import load_manifest, save_manifest
+from src.pages import page_stem, split_page
+from src.phash import Dedup, HashIndex, index_key
+from src.writer import CropWriter, OutputFormat, WriteResult
+
+# 记录导出结果的清单，用于增量导出
+MANIFEST_NAME = '.crops_manifest.json'
+
+# (图片路径, 顺时针角度, [(x, y, w, h), ...])，框坐标为旋转后显示图上的坐标
+CropJob = tuple[Path | str, int, list[tuple[float, float, float, float]]]
+
+
+def display_box_to_source(
+    box: tuple[int, int, int, int], size: tuple[int, int], angle: int
+) -> tuple[int, int, int, int]:
+    """把旋转后图上的框映射回原图坐标，仅支持 90 的倍数"""
+    x0, y0, x1, y1 = box
+    w, h = size
+    angle %= 360
+    if angle == 0:
+        return box
+    if angle == 90:
+        return y0, h - x1, y1, h - x0
+    if angle == 180:
+        return w - x1, h - y1, w - x0, h - y0
+    if angle == 270:
+        return w - y1, x0, w - y0, x1
+    raise ValueError(f"Unsupported angle: {angle}")
+
+
+def crop_boxes(
+    img_name: str,
+    rects: list[tuple[float, float, float, float]],
+    display_size: tuple[int, int],
+) -> list[tuple[int, int, int, int]]:
+    """把框裁剪到图片范围内并取整、去重，返回 (x0, y0, x1, y1)"""
+    w_img, h_img = display_size
+    boxes = []
+    for x, y, w_rect, h_rect in rects:
+        x0 = max(0, int(x))
+        y0 = max(0, int(y))
+        x1 = min(w_img, int(x + w_rect))
+        y1 = min(h_img, int(y + h_rect))
+        if x1 <= x0 or y1 <= y0:
+            raise ValueError(
+                f"Invalid rectangle for image {img_name}: ({x0}, {y0}, {x1}, {y1})"
+            )
+        if (x0, y0, x1, y1) not in boxes:
+            boxes.append((x0, y0, x1, y1))
+    return boxes
+
+
+def crop_name(img_name: str, box: tuple[int, int, int, int], ext: str = '.png') -> str:
+    x0, y0, x1, y1 = box
+    return f"{page_stem(img_name)}_{x0}_{y0}_{x1}_{y1}{ext}"
+
+
+def export_image(
+    path: Path | str,
+    angle: int,
+    boxes: list[tuple[int, int, int, int]],
+    output_dir: Path | str = 'output',
+    fmt: OutputFormat = OutputFormat(),
+    dedup: Dedup | None = None,
+) -> list[WriteResult]:
+    """导出单张图片上的框，返回每个输出的文件名、字节数和编码耗时
+
+    角度为 90 的倍数时先在原图上裁剪再转置小图，不旋转整张图。
+    编码和写盘交给 CropWriter 的线程，与下一个框的裁剪并行。
+    """
+    img_name = os.path.basename(path)
+    img = load_image(path)
+    rotated: Image.Image | None = None
+    with CropWriter(output_dir, fmt, dedup=dedup) as writer:
+        for box in boxes:
+            with perf.span('export.crop'):
+                if angle % 90 == 0:
+                    cropped = rotate_image(
+                        img.crop(display_box_to_source(box, img.size, angle)), angle
+                    )
+                else:
+                    if rotated is None:
+                        rotated = rotate_image(img, angle)
+                    cropped = rotated.crop(box)
+            writer.submit(crop_name(img_name, box, fmt.extension), cropped)
+    return writer.close()
+
+
+def _plan(
+    jobs: list[CropJob], output_dir: Path | str, manifest: dict, fmt: OutputFormat
+) -> tuple[set[str], list[tuple]]:
+    """只读文件头，返回 (所有应存在的输出名, 需要重新导出的任务)"""
+    wanted = set()
+    todo = []
+    for path, angle, rects in jobs:
+        img_name = os.path.basename(path)
+        st = os.stat(split_page(path)[0])
+        display_size = rotated_size(image_size(path), angle)
+        records = {}
+        for box in crop_boxes(img_name, rects, display_size):
+            out_name = crop_name(img_name, box, fmt.extension)
+            wanted.add(out_name)
+            record = {
+                'source': img_name,
+                'size': st.st_size,
+                'mtime_ns': st.st_mtime_ns,
+                'angle': angle,
+                'rect': list(box),
+                'format': fmt.spec,
+            }
+            saved = dict(manifest.get(out_name, {}))
+            # 因近似重复而跳过的框只记录在清单中，没有输出文件
+            skipped = saved.pop('duplicate_of', None) is not None
+            if saved == record and (
+                skipped or os.path.exists(os.path.join(output_dir, out_name))
+            ):
+                continue
+            records[out_name] = record
+        if records:
+            boxes = [tuple(r['rect']) for r in records.values()]
+            todo.append((path, angle, boxes, records))
+    return wanted, todo
+
+
+def export_crops(
+    jobs: list[CropJob],
+    output_dir: Path | str = 'output',
+    max_workers: int | None = None,
+    progress: Callable[[int, int], bool] | None = None,
+    fmt: OutputFormat = OutputFormat(),
+    dedup: Dedup | None = None,
+) -> tuple[list[WriteResult], bool]:
+    """在进程池中按图片并行导出，返回 (各输出的结果, 是否完成)
+
+    output_dir 下的清单记录每个输出对应的源文件大小、修改时间、角度和框，
+    只重新写出新增或变化的框，并删除不再对应任何框的旧输出。
+    progress(已完成图片数, 总数) 会被周期性调用，返回 False 时取消剩余任务。
+
+    给出 dedup 时，工作进程把每个框与哈希索引中已有的分割图片比较，
+    近似重复的按 dedup.mode 标出或跳过；新图片的哈希在主进程中写入索引。
+    同时在不同进程中导出的图片之间不互相比较。
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+    manifest = load_manifest(manifest_path)
+    index = None if dedup is None else HashIndex(dedup.path)
+
+    # 在主进程里只读文件头，决定哪些框需要重新导出
+    with perf.span('export.plan'):
+        wanted, todo = _plan(jobs, output_dir, manifest, fmt)
+
+    for out_name in set(manifest) - wanted:
+        try:
+            os.remove(os.path.join(output_dir, out_name))
+        except FileNotFoundError:
+            pass
+        del manifest[out_name]
+        if index is not None:
+            index.remove('crop', index_key(output_dir, out_name))
+
+    total = len(todo)
+    done = 0
+    written: list[WriteResult] = []
+    # GUI 进程中有 Qt 线程，用 spawn 避免 fork 带来的问题
+    executor = ProcessPoolExecutor(
+        max_workers, mp_context=multiprocessing.get_context('spawn')
+    )
+    try:
+        # 工作进程的计时记录随结果带回，未开启计时时为空
+        pending = {
+            executor.submit(
+                perf.call_traced,
+                export_image,
+                path,
+                angle,
+                boxes,
+                output_dir,
+                fmt,
+                dedup,
+            ): records
+            for path, angle, boxes, records in todo
+        }
+        while pending:
+            finished, _ = wait(pending, timeout=0.1, return_when=FIRST_COMPLETED)
+            for future in finished:
+                records = pending.pop(future)
+                results, events = future.result()
+                perf.add_events(events)
+                written.extend(results)
+                for result in results:
+                    if result.skipped:
+                        records[result.name]['duplicate_of'] = result.duplicate_of
+                    elif index is not None and result.duplicate_of is None:
+                        index.add(
+                            'crop', index_key(output_dir, result.name), result.phash
+                        )
+                if index is not None:
+                    # 提交后之后开始的工作进程才能查到这些分割图片
+                    index.commit()
+                manifest.update(records)
+                done += 1
+            if progress is not None and not progress(done, total):
+                return written, False
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+        save_manifest(manifest_path, manifest)
+        if index is not None:
+            index.commit()
+            index.close()
+    return written, True
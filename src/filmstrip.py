@@ -0,0 +1,161 @@
+from PySide6 import QtCore, QtGui, QtWidgets
+
+from src.display import pil_to_qimage, pixmap_nbytes
+from src.image_cache import ImageCache
+from src.image_state import ImageState
+from src.thumbnails import THUMB_SIZE, ThumbnailCache
+
+
+class _ThumbJob(QtCore.QRunnable):
+    def __init__(self, model: 'ThumbnailModel', path):
+        super().__init__()
+        self._model = model
+        self._path = path
+
+    def run(self):
+        # 已滚出可见范围，放弃
+        if self._path not in self._model.wanted:
+            return
+        try:
+            thumb = self._model.disk_cache.get(self._path)
+        except OSError:
+            return
+        qimg, data = pil_to_qimage(thumb)
+        self._model.thumb_ready.emit(self._path, (qimg, data))
+
+
+class ThumbnailModel(QtCore.QAbstractListModel):
+    """图片列表的缩略图模型
+
+    视图只为可见行请求数据，缩略图在后台线程从磁盘缓存读取或生成，
+    显示时再按各图片的角度旋转，并标注框数量。
+    """
+
+    thumb_ready = QtCore.Signal(object, object)
+
+    def __init__(
+        self,
+        images: list[ImageState],
+        disk_cache: ThumbnailCache | None = None,
+        parent: QtCore.QObject | None = None,
+    ):
+        super().__init__(parent)
+        self.images = images
+        self.disk_cache = disk_cache or ThumbnailCache()
+        # 已排队或正在生成的路径
+        self.wanted: set = set()
+        self._pixmaps = ImageCache(64 * 1024 * 1024, nbytes=pixmap_nbytes)
+        self._rows: dict = {}
+        self._pool = QtCore.QThreadPool(self)
+        self._pool.setMaxThreadCount(2)
+        self.thumb_ready.connect(self._on_ready)
+        self._placeholder = QtGui.QPixmap(THUMB_SIZE, THUMB_SIZE)
+        self._placeholder.fill(QtGui.QColor("#d8d8e0"))
+
+    def rowCount(self, parent: QtCore.QModelIndex = QtCore.QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self.images)
+
+    def data(self, index: QtCore.QModelIndex, role: int = 0):
+        if not index.isValid():
+            return None
+        state = self.images[index.row()]
+        if role == QtCore.Qt.ItemDataRole.DisplayRole:
+            text = f"{index.row() + 1}"
+            if state.angle:
+                text += f"  ↻{state.angle}°"
+            if state.rects:
+                text += f"  ▭{len(state.rects)}"
+            return text
+        if role == QtCore.Qt.ItemDataRole.DecorationRole:
+            return self._thumbnail(index.row(), state)
+        if role == QtCore.Qt.ItemDataRole.ToolTipRole:
+            return str(state.path)
+        return None
+
+    def _thumbnail(self, row: int, state: ImageState) -> QtGui.QPixmap:
+        rotated = self._pixmaps.peek((state.path, state.angle))
+        if rotated is not None:
+            return rotated
+        pixmap = self._pixmaps.peek(state.path)
+        if pixmap is None:
+            self._request(row, state.path)
+            return self._placeholder
+        if state.angle % 360 == 0:
+            return pixmap
+        rotated = pixmap.transformed(
+            QtGui.QTransform().rotate(state.angle),
+            QtCore.Qt.TransformationMode.SmoothTransformation,
+        )
+        self._pixmaps.put((state.path, state.angle), rotated)
+        return rotated
+
+    def _request(self, row: int, path):
+        self._rows[path] = row
+        if path in self.wanted:
+            return
+        self.wanted.add(path)
+        self._pool.start(_ThumbJob(self, path))
+
+    def _on_ready(self, path, payload):
+        self.wanted.discard(path)
+        qimg, _data = payload
+        self._pixmaps.put(path, QtGui.QPixmap.fromImage(qimg))
+        row = self._rows.pop(path, None)
+        if row is not None:
+            self.refresh(row)
+
+    def refresh(self, row: int | None = None):
+        """图片的角度或框变化后更新该行，不指定时更新全部"""
+        if not self.images:
+            return
+        first = self.index(0 if row is None else row)
+        last = self.index(len(self.images) - 1 if row is None else row)
+        self.dataChanged.emit(first, last)
+
+    def append(self, states: list[ImageState]):
+        """在末尾追加图片，已有行的序号不变"""
+        first = len(self.images)
+        self.beginInsertRows(QtCore.QModelIndex(), first, first + len(states) - 1)
+        self.images.extend(states)
+        self.endInsertRows()
+
+    def cancel_pending(self):
+        """丢弃尚未开始的任务，可见行会在下次绘制时重新请求"""
+        self._pool.clear()
+        self.wanted.clear()
+
+    def shutdown(self):
+        self.cancel_pending()
+        self._pool.waitForDone()
+
+
+class Filmstrip(QtWidgets.QListView):
+    """竖向缩略图列表，只绘制可见行，点击跳转到对应图片"""
+
+    page_selected = QtCore.Signal(int)
+
+    def __init__(self, model: ThumbnailModel, parent: QtWidgets.QWidget | None = None):
+        super().__init__(parent)
+        self.setModel(model)
+        # 各行等高，视图不必为每一行查询尺寸，上万张图片也能立即显示
+        self.setUniformItemSizes(True)
+        self.setLayoutMode(QtWidgets.QListView.LayoutMode.Batched)
+        # 图标模式下文字在缩略图下方，单列从上到下排列
+        self.setViewMode(QtWidgets.QListView.ViewMode.IconMode)
+        self.setFlow(QtWidgets.QListView.Flow.TopToBottom)
+        self.setWrapping(False)
+        self.setMovement(QtWidgets.QListView.Movement.Static)
+        self.setIconSize(QtCore.QSize(THUMB_SIZE, THUMB_SIZE))
+        self.setFixedWidth(THUMB_SIZE + 40)
+        self.setSelectionMode(QtWidgets.QAbstractItemView.SelectionMode.SingleSelection)
+        self.clicked.connect(lambda index: self.page_selected.emit(index.row()))
+        self.verticalScrollBar().valueChanged.connect(self._on_scroll)
+
+    def _on_scroll(self):
+        # 快速滚动时放弃已滚出视口的缩略图任务
+        self.model().cancel_pending()
+
+    def select_row(self, row: int):
+        index = self.model().index(row)
+        self.setCurrentIndex(index)
+        self.scrollTo(index)
@@ -0,0 +1,103 @@
+import threading
+from collections import OrderedDict
+from collections.abc import Callable, Hashable
+from typing import Any
+
+from PIL import Image
+
+# 各模式每像素字节数，未列出的按 4 字节估算
+_MODE_BYTES = {'1': 1, 'L': 1, 'P': 1, 'I;16': 2, 'LA': 2, 'RGB': 3, 'YCbCr': 3}
+
+
+def image_nbytes(img: Image.Image) -> int:
+    w, h = img.size
+    return w * h * _MODE_BYTES.get(img.mode, 4)
+
+
+class ImageCache:
+    """按解码后字节数限制容量的 LRU 图片缓存，多线程安全
+
+    nbytes 用于估算条目大小，缓存 PIL 以外的对象（如 QPixmap）时传入。
+    同一键同时只加载一次，其他线程等待结果。
+    """
+
+    def __init__(
+        self,
+        max_bytes: int = 512 * 1024 * 1024,
+        nbytes: Callable[[Any], int] = image_nbytes,
+    ):
+        self.max_bytes = max_bytes
+        self._nbytes = nbytes
+        self._items: OrderedDict[Hashable, Any] = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        # 正在加载的键 -> 加载完成时设置的事件
+        self._loading: dict[Hashable, threading.Event] = {}
+
+    @property
+    def total_bytes(self) -> int:
+        return self._bytes
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            return key in self._items
+
+    def peek(self, key: Hashable) -> Any | None:
+        """命中时返回条目并刷新其 LRU 顺序，未命中返回 None，不加载"""
+        with self._lock:
+            img = self._items.get(key)
+            if img is not None:
+                self._items.move_to_end(key)
+            return img
+
+    def get(self, key: Hashable, loader: Callable[[], Any]) -> Any:
+        while True:
+            with self._lock:
+                img = self._items.get(key)
+                if img is not None:
+                    self._items.move_to_end(key)
+                    return img
+                event = self._loading.get(key)
+                if event is None:
+                    event = self._loading[key] = threading.Event()
+                    break
+            # 其他线程正在加载同一键，等它完成后重新查找
+            event.wait()
+        # 解码放在锁外，避免阻塞其他键
+        try:
+            img = loader()
+            self.put(key, img)
+        finally:
+            with self._lock:
+                del self._loading[key]
+            event.set()
+        return img
+
+    def put(self, key: Hashable, img: Any):
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self._bytes -= self._nbytes(old)
+            self._items[key] = img
+            self._bytes += self._nbytes(img)
+            self._evict(keep=key)
+
+    def _evict(self, keep: Hashable | None = None):
+        # 从最久未使用的开始淘汰，跳过刚放入的条目
+        for old_key in list(self._items):
+            if self._bytes <= self.max_bytes:
+                return
+            if old_key == keep:
+                continue
+            self._bytes -= self._nbytes(self._items.pop(old_key))
+
+    def discard(self, key: Hashable):
+        with self._lock:
+            img = self._items.pop(key, None)
+            if img is not None:
+                self._bytes -= self._nbytes(img)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self._bytes = 0
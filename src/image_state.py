@@ -1,76 +1,298 @@
+import math
 import os
+from collections.abc import Iterable
 from pathlib import Path
 
-from PIL import Image
-from PySide6 import QtCore, QtGui
+from typing import TYPE_CHECKING
+
+from PIL import Image, ImageOps
+
+from src import perf
+from src.image_cache import ImageCache
+from src.pages import (
+    PDF_EXTENSIONS,
+    TIFF_EXTENSIONS,
+    expand_pages,
+    is_pdf,
+    pdf_page_size,
+    render_pdf_page,
+    split_page,
+)
+from src.rect_store import Rect, RectStore
+
+if TYPE_CHECKING:
+    from PySide6 import QtCore, QtGui
+
+# EXIF 方向标签
+ORIENTATION_TAG = 0x0112
+# apply_rotation 改写方向标签时一并写入的 JPEG APP11 标记段。本工具早期版本
+# 忽略方向标签，已保存的框按未摆正的像素标注；只有带此标记的文件才按方向摆正，
+# 相机写入的方向标签仍然忽略，旧的框不会错位
+ORIENTATION_MARKER = b'ImageSplitter\0orientation'
+
+# 支持的图片扩展名（小写），TIFF 和 PDF 可以有多页
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp') + TIFF_EXTENSIONS + PDF_EXTENSIONS
+
+# Pillow 默认超过约 1.8 亿像素就当作解压炸弹拒绝打开，而大幅面扫描正是
+# 分块显示要处理的对象；放宽到 10 亿像素（超过 20 亿像素仍然报错）
+Image.MAX_IMAGE_PIXELS = 1_000_000_000
+
+# 显示用缩小图的最大缩小倍数，JPEG 可在 DCT 域直接缩小 2/4/8 倍
+MAX_REDUCE_FACTOR = 8
+
+
+def load_image(path: Path | str, factor: int = 1) -> Image.Image:
+    """解码并按本工具写入的 EXIF 方向摆正，factor > 1 时缩小 factor 倍
+
+    JPEG 用 draft() 在解码时按 DCT 缩放，只解码需要的分辨率；
+    其他格式解码后再用 reduce() 缩小。'文件#页码' 只解码该页，
+    PDF 直接按缩小后的分辨率渲染。
+    """
+    with perf.span('decode'):
+        path, page = split_page(path)
+        if is_pdf(path):
+            return render_pdf_page(path, page or 1, factor)
+        # 退出 with 只关闭文件，已解码的像素仍可用；多帧文件不会自动关闭
+        with Image.open(path) as img:
+            if page is not None:
+                img.seek(page - 1)
+            orientation = header_orientation(img)
+            remaining = factor
+            if factor > 1:
+                full_width = img.width
+                img.draft(None, (img.width // factor, img.height // factor))
+                # draft 只支持 2/4/8 倍且对非 JPEG 无效，不足的部分用 reduce 补齐；
+                # 奇数尺寸时 draft 向上取整，比例要四舍五入
+                remaining = factor // round(full_width / img.width)
+            img.load()
+        # 按本工具写入的 EXIF 方向摆正，apply_rotation 的 exif 模式依赖这一点
+        if orientation != 1:
+            ImageOps.exif_transpose(img, in_place=True)
+        if remaining > 1:
+            img = img.reduce(remaining)
+    return img
+
+
+def list_images(directory: Path | str) -> list[str]:
+    """目录中的图片名，多页文件展开为 '文件#页码'，只读取文件结构"""
+    names = []
+    for name in sorted(os.listdir(directory)):
+        if name.lower().endswith(IMAGE_EXTENSIONS):
+            pages = expand_pages(os.path.join(directory, name))
+            names.extend(os.path.basename(p) for p in pages)
+    return names
+
+
+def reduce_factor(scale: float) -> int:
+    """视图缩放为 scale 时，缩小图的一个像素不超过一个屏幕像素的最大 2 的幂倍数"""
+    factor = 1
+    while factor < MAX_REDUCE_FACTOR and scale * factor * 2 <= 1:
+        factor *= 2
+    return factor
+
+
+def image_size(path: Path | str) -> tuple[int, int]:
+    """只读取文件头得到摆正后的尺寸"""
+    path, page = split_page(path)
+    if is_pdf(path):
+        return pdf_page_size(path, page or 1)
+    with Image.open(path) as img:
+        if page is not None:
+            img.seek(page - 1)
+        w, h = img.size
+        # 方向 5-8 需要交换宽高
+        if header_orientation(img) in (5, 6, 7, 8):
+            return h, w
+        return w, h
+
+
+def header_orientation(img: Image.Image) -> int:
+    """已打开但未解码的图片中由本工具写入的 EXIF 方向，没有标记段时为 1"""
+    if not any(
+        marker == 'APP11' and body.startswith(ORIENTATION_MARKER)
+        for marker, body in getattr(img, 'applist', ())
+    ):
+        return 1
+    return img.getexif().get(ORIENTATION_TAG, 1)
+
+
+def upright(img: Image.Image) -> Image.Image:
+    """按 header_orientation() 摆正后的副本"""
+    if header_orientation(img) == 1:
+        return img.copy()
+    return ImageOps.exif_transpose(img)
+
+
+# 顺时针旋转角度到无损转置操作的映射
+_TRANSPOSE = {
+    90: Image.Transpose.ROTATE_270,
+    180: Image.Transpose.ROTATE_180,
+    270: Image.Transpose.ROTATE_90,
+}
+
+
+def rotate_image(img: Image.Image, angle: int) -> Image.Image:
+    """顺时针旋转 angle 度，90 的倍数用转置代替重采样"""
+    angle %= 360
+    if angle == 0:
+        return img
+    op = _TRANSPOSE.get(angle)
+    if op is not None:
+        return img.transpose(op)
+    return img.rotate(-angle, expand=True)
+
+
+def rotated_size(size: tuple[int, int], angle: int) -> tuple[int, int]:
+    """不解码像素，计算 rotate_image 结果的尺寸，与 PIL rotate(expand=True) 一致"""
+    angle %= 360
+    w, h = size
+    if angle in (0, 180):
+        return w, h
+    if angle in (90, 270):
+        return h, w
+    rad = math.radians(angle)
+    a, b = round(math.cos(rad), 15), round(math.sin(rad), 15)
+    cx, cy = w / 2.0, h / 2.0
+    c = a * -cx + b * -cy + cx
+    f = -b * -cx + a * -cy + cy
+    corners = [(0, 0), (w, 0), (w, h), (0, h)]
+    xx = [a * x + b * y + c for x, y in corners]
+    yy = [-b * x + a * y + f for x, y in corners]
+    return (
+        math.ceil(max(xx)) - math.floor(min(xx)),
+        math.ceil(max(yy)) - math.floor(min(yy)),
+    )
 
 
 class ImageState:
+    """单张图片的标注状态，不依赖 Qt，可在工作进程中使用
+
+    transform/center 是 GUI 保存的视图状态，核心逻辑不读取。
+    """
+
+    __slots__ = ('path', 'angle', '_rects', 'transform', 'center', '_size')
+
+    # 所有 ImageState 共享的解码缓存，切换图片时按 LRU 淘汰
+    cache = ImageCache()
+
     def __init__(self, path: Path | str):
         self.path = path
-        self.image = Image.open(path)
         self.angle = 0
-        self.rects: list[QtCore.QRectF] = []
+        self._rects = RectStore()
         self.transform: 'QtGui.QTransform | None' = None
         self.center: 'QtCore.QPointF | None' = None
+        self._size: tuple[int, int] | None = None
+
+    @property
+    def rects(self) -> RectStore:
+        return self._rects
+
+    @rects.setter
+    def rects(self, rects: Iterable[Rect]):
+        # 整体替换时重新分配 id
+        self._rects = RectStore(rects)
+
+    @property
+    def image(self) -> Image.Image:
+        # 只在真正需要像素时才解码
+        return self.cache.get(self.path, lambda: load_image(self.path))
+
+    @property
+    def size(self) -> tuple[int, int]:
+        # 只读取文件头，不解码像素
+        if self._size is None:
+            self._size = image_size(self.path)
+        return self._size
+
+    @property
+    def display_size(self) -> tuple[int, int]:
+        return rotated_size(self.size, self.angle)
+
+    def reduced(self, factor: int) -> Image.Image:
+        """缩小 factor 倍的摆正图片，与原图分开缓存"""
+        if factor <= 1:
+            return self.image
+
+        def load():
+            # 原图已在缓存中时直接缩小，比重新解码快
+            full = self.cache.peek(self.path)
+            if full is not None:
+                return full.reduce(factor)
+            return load_image(self.path, factor)
+
+        return self.cache.get((self.path, 'reduced', factor), load)
 
-    def get_display_image(self):
-        return self.image.rotate(-self.angle, expand=True)
+    def get_display_image(self, factor: int = 1):
+        """旋转后的显示图，factor > 1 时为缩小图，框坐标仍按原图计算"""
+        with perf.span('get_display_image'):
+            img = self.reduced(factor)
+            with perf.span('rotate'):
+                return rotate_image(img, self.angle)
 
     @staticmethod
     def save_all(states: list['ImageState'], save_path):
-        with open(save_path, "w", encoding="utf-8") as f:
-            for img_state in states:
-                has_angle = img_state.angle != 0
-                has_rects = bool(img_state.rects)
-                if not has_angle and not has_rects:
-                    continue
-                img_name = os.path.basename(img_state.path)
-                f.write(f"{img_name}\n")
-                if has_angle:
-                    f.write(f"angle: {img_state.angle}\n")
-                for rect in img_state.rects:
-                    f.write(
-                        f"rect: {int(rect.x())},{int(rect.y())},{int(rect.width())},{int(rect.height())}\n"
-                    )
-                f.write("\n")
+        with perf.span('save_all'):
+            write_legacy_states(
+                (
+                    (os.path.basename(img_state.path), img_state.angle, img_state.rects)
+                    for img_state in states
+                ),
+                save_path,
+            )
 
     @staticmethod
     def load_all(states: list['ImageState'], load_path):
         if not os.path.exists(load_path):
             return False
-        with open(load_path, "r", encoding="utf-8") as f:
-            lines = f.readlines()
-        img_map = {os.path.basename(img_state.path): img_state for img_state in states}
-        cur_img = None
-        for line in lines:
+        with perf.span('load_all'):
+            entries = read_legacy_states(load_path)
+            for img_state in states:
+                entry = entries.get(os.path.basename(img_state.path))
+                if entry is not None:
+                    img_state.angle, img_state.rects = entry
+        return True
+
+
+# 文本格式的一条状态：(图片名, 角度, [(x, y, w, h), ...])
+LegacyEntry = tuple[str, int, list[Rect]]
+
+
+def write_legacy_states(entries: Iterable[LegacyEntry], save_path):
+    """写出 image_states.txt 文本格式，跳过无角度且无框的图片"""
+    with open(save_path, "w", encoding="utf-8") as f:
+        for img_name, angle, rects in entries:
+            if angle == 0 and not rects:
+                continue
+            f.write(f"{img_name}\n")
+            if angle != 0:
+                f.write(f"angle: {angle}\n")
+            for x, y, w, h in rects:
+                f.write(f"rect: {x},{y},{w},{h}\n")
+            f.write("\n")
+
+
+def read_legacy_states(load_path) -> dict[str, tuple[int, list[Rect]]]:
+    """解析 image_states.txt 文本格式，格式错误时抛出带行号的 ValueError"""
+    entries = {}
+    cur = None
+    with open(load_path, "r", encoding="utf-8") as f:
+        for lineno, line in enumerate(f, 1):
             line = line.strip()
             if not line:
-                cur_img = None
-                continue
-            if (
-                line.endswith(".jpg")
-                or line.endswith(".png")
-                or line.endswith(".jpeg")
-                or line.endswith(".bmp")
-            ):
-                cur_img = img_map.get(line)
-                if cur_img:
-                    cur_img.angle = 0
-                    cur_img.rects = []
+                cur = None
                 continue
-            if cur_img is None:
+            key, sep, value = line.partition(":")
+            if cur is None or not sep or key not in ("angle", "rect"):
+                # 空行后的第一行是图片名
+                cur = [0, []]
+                entries[line] = cur
                 continue
-            if line.startswith("angle:"):
-                try:
-                    cur_img.angle = int(line.split(":", 1)[1].strip())
-                except Exception:
-                    pass
-            elif line.startswith("rect:"):
-                try:
-                    vals = line.split(":", 1)[1].strip().split(",")
-                    x, y, w, h = map(int, vals)
-                    cur_img.rects.append(QtCore.QRectF(x, y, w, h))
-                except Exception:
-                    pass
-        return True
+            try:
+                if key == "angle":
+                    cur[0] = int(value.strip())
+                else:
+                    x, y, w, h = map(int, value.strip().split(","))
+                    cur[1].append((x, y, w, h))
+            except ValueError as e:
+                raise ValueError(f"{load_path}:{lineno}: 无法解析 {line!r}") from e
+    return {name: (angle, rects) for name, (angle, rects) in entries.items()}
@@ -0,0 +1,21 @@
+"""增量处理的清单：输出目录下的 JSON 文件，记录每个输入或输出已完成的状态"""
+
+import json
+import os
+
+
+def load_manifest(path: str) -> dict:
+    """读取清单，不存在或已损坏时返回空清单"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_manifest(path: str, manifest: dict):
+    """先写临时文件再改名，中断时不会留下半个清单"""
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
@@ -0,0 +1,105 @@
+"""多页文件（多帧 TIFF、PDF）的逐页寻址
+
+多页文件的每一页是一张独立的逻辑图片，路径写作 '文件#页码'（页码从 1 开始），
+状态库中的图片名和输出文件名都按文件加页码区分。单页文件仍用原路径。
+各页按需打开：TIFF 只沿 IFD 链定位到该帧再解码，PDF 只渲染该页。
+"""
+
+import math
+import os
+import threading
+from pathlib import Path
+
+from PIL import Image
+
+try:
+    # 可选依赖：没有时不识别 PDF
+    import pypdfium2 as pdfium
+except ImportError:
+    pdfium = None
+
+PAGE_SEP = '#'
+TIFF_EXTENSIONS = ('.tif', '.tiff')
+PDF_EXTENSIONS = ('.pdf',) if pdfium is not None else ()
+# PDF 按该分辨率渲染为像素图
+PDF_DPI = 200
+# pdfium 不是线程安全的，进程内所有调用都要串行
+_pdfium_lock = threading.Lock()
+
+
+def page_path(path: Path | str, page: int) -> str:
+    return f"{path}{PAGE_SEP}{page}"
+
+
+def split_page(path: Path | str) -> tuple[str, int | None]:
+    """'scan.tif#3' -> ('scan.tif', 3)，普通路径的页码为 None"""
+    path = str(path)
+    head, sep, tail = path.rpartition(PAGE_SEP)
+    if (
+        sep
+        and tail.isdigit()
+        and head.lower().endswith(TIFF_EXTENSIONS + PDF_EXTENSIONS)
+    ):
+        return head, int(tail)
+    return path, None
+
+
+def page_stem(name: Path | str) -> str:
+    """输出文件名的前缀：'scan.tif#3' -> 'scan_p3'，'a.png' -> 'a'"""
+    path, page = split_page(name)
+    stem = os.path.splitext(os.path.basename(path))[0]
+    return stem if page is None else f"{stem}_p{page}"
+
+
+def is_pdf(path: Path | str) -> bool:
+    return str(path).lower().endswith('.pdf')
+
+
+def page_count(path: Path | str) -> int:
+    """只读取文件结构得到页数，不解码像素"""
+    if is_pdf(path):
+        with _pdfium_lock:
+            pdf = pdfium.PdfDocument(path)
+            try:
+                return len(pdf)
+            finally:
+                pdf.close()
+    with Image.open(path) as img:
+        return getattr(img, 'n_frames', 1)
+
+
+def expand_pages(path: Path | str) -> list[str]:
+    """把文件展开为逻辑图片路径，多页文件每页一个"""
+    if not str(path).lower().endswith(TIFF_EXTENSIONS + PDF_EXTENSIONS):
+        return [str(path)]
+    try:
+        count = page_count(path)
+    except (OSError, ValueError, RuntimeError):
+        # 无法读取的文件交给后续解码时报错
+        return [str(path)]
+    if count == 1:
+        return [str(path)]
+    return [page_path(path, page) for page in range(1, count + 1)]
+
+
+def pdf_page_size(path: Path | str, page: int) -> tuple[int, int]:
+    """按 PDF_DPI 渲染时的像素尺寸"""
+    with _pdfium_lock:
+        pdf = pdfium.PdfDocument(path)
+        try:
+            w, h = pdf[page - 1].get_size()
+        finally:
+            pdf.close()
+    # 与 pdfium 渲染时一样向上取整
+    return math.ceil(w * PDF_DPI / 72), math.ceil(h * PDF_DPI / 72)
+
+
+def render_pdf_page(path: Path | str, page: int, factor: int = 1) -> Image.Image:
+    """直接以 1/factor 的分辨率渲染 PDF 的一页"""
+    with _pdfium_lock:
+        pdf = pdfium.PdfDocument(path)
+        try:
+            bitmap = pdf[page - 1].render(scale=PDF_DPI / 72 / factor)
+            return bitmap.to_pil().convert('RGB')
+        finally:
+            pdf.close()
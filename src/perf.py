@@ -0,0 +1,186 @@
+"""热点路径计时
+
+设置环境变量 IMAGESPLITTER_PERF=1（或调用 enable()）后，span() 记录各阶段耗时，
+可查看每个阶段最近一次和 p95 耗时，并导出 Chrome trace 格式
+（chrome://tracing 或 Perfetto 打开）。关闭时 span() 直接返回空的上下文管理器。
+
+不依赖 Qt，可在工作进程中使用；工作进程里的记录通过 call_traced 带回主进程。
+"""
+
+import contextlib
+import json
+import os
+import sys
+import threading
+import time
+from collections import deque
+from collections.abc import Callable
+from pathlib import Path
+
+PERF_ENV = 'IMAGESPLITTER_PERF'
+
+enabled = os.environ.get(PERF_ENV, '') not in ('', '0')
+
+# 每个阶段保留最近若干次耗时用于统计
+_HISTORY = 256
+# trace 事件上限，超出后丢弃最早的
+_MAX_EVENTS = 200_000
+
+_lock = threading.Lock()
+_durations: dict[str, deque] = {}
+_events: deque = deque(maxlen=_MAX_EVENTS)
+_NOOP = contextlib.nullcontext()
+
+
+def enable(on: bool = True):
+    """开启或关闭计时，同时设置环境变量让之后启动的工作进程继承"""
+    global enabled
+    enabled = on
+    os.environ[PERF_ENV] = '1' if on else '0'
+
+
+class _Span:
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        record(self.name, self.start, time.perf_counter())
+        return False
+
+
+def span(name: str):
+    """with span('decode'): ... 记录一个阶段的耗时"""
+    if not enabled:
+        return _NOOP
+    return _Span(name)
+
+
+def record(name: str, start: float, end: float):
+    # perf_counter 在 Linux 上是系统范围的单调时钟，不同进程的时间戳可直接对齐
+    event = {
+        'name': name,
+        'ph': 'X',
+        'ts': start * 1e6,
+        'dur': (end - start) * 1e6,
+        'pid': os.getpid(),
+        'tid': threading.get_ident(),
+    }
+    with _lock:
+        _events.append(event)
+        _durations.setdefault(name, deque(maxlen=_HISTORY)).append(end - start)
+
+
+def add_events(events: list[dict]):
+    """合并工作进程带回的事件"""
+    with _lock:
+        for event in events:
+            _events.append(event)
+            _durations.setdefault(event['name'], deque(maxlen=_HISTORY)).append(
+                event['dur'] / 1e6
+            )
+
+
+def drain_events() -> list[dict]:
+    with _lock:
+        events = list(_events)
+        _events.clear()
+    return events
+
+
+def call_traced(fn: Callable, *args):
+    """在工作进程中调用 fn，返回 (结果, 本次调用记录的事件)"""
+    drain_events()
+    return fn(*args), drain_events()
+
+
+def stats() -> dict[str, tuple[float, float, int]]:
+    """各阶段 (最近一次, p95, 记录次数)，单位秒"""
+    with _lock:
+        snapshot = {name: list(values) for name, values in _durations.items()}
+    result = {}
+    for name, values in snapshot.items():
+        ordered = sorted(values)
+        p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+        result[name] = (values[-1], p95, len(values))
+    return result
+
+
+def memory_bytes() -> int:
+    """当前进程常驻内存，Windows 上为工作集"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        pass
+    try:
+        import psutil
+    except ImportError:
+        pass
+    else:
+        return psutil.Process().memory_info().rss
+    if sys.platform == 'win32':
+        return _working_set()
+    try:
+        import resource
+    except ImportError:
+        return 0
+    # 非 Linux 上只能取到峰值，macOS 单位为字节，其余为 KB
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+def _working_set() -> int:
+    """Windows 上用 GetProcessMemoryInfo 取当前进程的工作集"""
+    import ctypes
+    from ctypes import wintypes
+
+    class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+        _fields_ = [
+            ('cb', wintypes.DWORD),
+            ('PageFaultCount', wintypes.DWORD),
+            ('PeakWorkingSetSize', ctypes.c_size_t),
+            ('WorkingSetSize', ctypes.c_size_t),
+            ('QuotaPeakPagedPoolUsage', ctypes.c_size_t),
+            ('QuotaPagedPoolUsage', ctypes.c_size_t),
+            ('QuotaPeakNonPagedPoolUsage', ctypes.c_size_t),
+            ('QuotaNonPagedPoolUsage', ctypes.c_size_t),
+            ('PagefileUsage', ctypes.c_size_t),
+            ('PeakPagefileUsage', ctypes.c_size_t),
+        ]
+
+    counters = PROCESS_MEMORY_COUNTERS()
+    counters.cb = ctypes.sizeof(counters)
+    kernel32 = ctypes.WinDLL('kernel32')
+    # Windows 7 起 kernel32 导出 K32GetProcessMemoryInfo，不需要 psapi.dll
+    get_info = kernel32.K32GetProcessMemoryInfo
+    get_info.argtypes = [
+        wintypes.HANDLE,
+        ctypes.POINTER(PROCESS_MEMORY_COUNTERS),
+        wintypes.DWORD,
+    ]
+    get_info.restype = wintypes.BOOL
+    kernel32.GetCurrentProcess.restype = wintypes.HANDLE
+    if not get_info(kernel32.GetCurrentProcess(), ctypes.byref(counters), counters.cb):
+        return 0
+    return counters.WorkingSetSize
+
+
+def export_trace(path: Path | str) -> int:
+    """写出 Chrome trace JSON，返回事件数"""
+    with _lock:
+        events = list(_events)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+    return len(events)
+
+
+def reset():
+    with _lock:
+        _events.clear()
+        _durations.clear()
@@ -0,0 +1,53 @@
+from PySide6 import QtCore, QtWidgets
+
+from src import perf
+from src.image_cache import ImageCache
+
+# 状态栏上依次显示的阶段，其余阶段只在提示中列出
+OVERLAY_STAGES = (
+    'display_image',
+    'decode',
+    'rotate',
+    'to_qimage',
+    'pixmap_upload',
+    'scene_rebuild',
+    'save_crops',
+)
+
+
+def _ms(seconds: float) -> str:
+    return f"{seconds * 1000:.1f}"
+
+
+class PerfOverlay(QtWidgets.QLabel):
+    """状态栏中的性能面板：各阶段最近一次/p95 耗时（毫秒）和内存占用"""
+
+    def __init__(
+        self,
+        caches: dict[str, ImageCache] | None = None,
+        interval: int = 1000,
+        parent: QtWidgets.QWidget | None = None,
+    ):
+        super().__init__(parent)
+        self.caches = caches or {}
+        self.setTextFormat(QtCore.Qt.TextFormat.PlainText)
+        self._timer = QtCore.QTimer(self)
+        self._timer.timeout.connect(self.refresh)
+        self._timer.start(interval)
+        self.refresh()
+
+    def refresh(self):
+        stats = perf.stats()
+        parts = [
+            f"{name} {_ms(stats[name][0])}/{_ms(stats[name][1])}"
+            for name in OVERLAY_STAGES
+            if name in stats
+        ]
+        parts.append(f"内存 {perf.memory_bytes() >> 20}MB")
+        for label, cache in self.caches.items():
+            parts.append(f"{label} {cache.total_bytes >> 20}MB")
+        self.setText("  ·  ".join(parts))
+        lines = ["阶段: 最近/p95 毫秒 (次数)"]
+        for name, (last, p95, count) in sorted(stats.items()):
+            lines.append(f"{name}: {_ms(last)}/{_ms(p95)} ({count})")
+        self.setToolTip("\n".join(lines))
@@ -0,0 +1,317 @@
+import functools
+import math
+import os
+import sqlite3
+import threading
+from collections.abc import Iterator
+from pathlib import Path
+from typing import NamedTuple
+
+import numpy as np
+from PIL import Image, ImageFilter
+
+from src import perf
+from src.image_state import image_size, load_image, reduce_factor
+
+HASH_DB = 'image_hashes.db'
+
+# 哈希位数及分段：64 位分为 4 段，每段 16 位各建索引
+HASH_BITS = 64
+BANDS = 4
+BAND_BITS = HASH_BITS // BANDS
+# 计算整页哈希前先缩小到长边约为该值
+PAGE_SIDE = 256
+
+# 哈希系数的 (行, 列) 排布，都是 64 位，按图片宽高比选用
+_SHAPES = ((8, 8), (4, 16), (2, 32), (16, 4), (32, 2))
+
+# 哈希相近的候选还要核对：宽、高相差不超过该比例，
+SIZE_TOLERANCE = 0.05
+# 且缩小到约该像素数并轻微模糊后，在 ±CONFIRM_SHIFT 像素的平移内
+# 相关系数不低于 MIN_CORRELATION
+CONFIRM_AREA = 128 * 128
+CONFIRM_SHIFT = 2
+MIN_CORRELATION = 0.9
+
+
+@functools.cache
+def _dct(n: int) -> np.ndarray:
+    """n x n 的 DCT-II 变换矩阵"""
+    k = np.arange(n)
+    return np.cos(np.pi * (2 * k[None, :] + 1) * k[:, None] / (2 * n))
+
+
+def phash(img: Image.Image) -> int:
+    """64 位感知哈希：缩小的灰度图做 DCT，取低频系数与中位数比较
+
+    扫描页大部分是白色，差异哈希（dHash）在空白处全为 0，不同页面也很接近；
+    与中位数比较后各位 0、1 大致各半，区分度更好。
+    接近方形的页面取 32x32 图的左上 8x8 系数；细长的分割图片压成方形后
+    几行文字只剩几个像素，内容不同也很接近，因此沿长边取更多系数（如 4x16）。
+    """
+    ratio = img.width / img.height
+    rows, cols = min(_SHAPES, key=lambda s: abs(math.log(s[1] / s[0] / ratio)))
+    small = img.convert('L').resize((cols * 4, rows * 4), Image.Resampling.BOX)
+    pixels = np.asarray(small, dtype=np.float64)
+    coeffs = (_dct(rows * 4) @ pixels @ _dct(cols * 4).T)[:rows, :cols].ravel()
+    # 直流分量只反映整体亮度，不参与中位数
+    bits = np.packbits(coeffs > np.median(coeffs[1:]))
+    return int.from_bytes(bits.tobytes(), 'big')
+
+
+def index_key(directory: Path | str, name: str) -> str:
+    """索引中的条目名：文件的绝对路径，核对候选时据此读取像素"""
+    return os.path.abspath(os.path.join(directory, name))
+
+
+def _similar_size(size: tuple[int, int], other: tuple[int, int]) -> bool:
+    return all(abs(a - b) <= SIZE_TOLERANCE * max(a, b) for a, b in zip(size, other))
+
+
+def _confirm_shape(size: tuple[int, int]) -> tuple[int, int]:
+    scale = min(1.0, math.sqrt(CONFIRM_AREA / (size[0] * size[1])))
+    return max(1, round(size[0] * scale)), max(1, round(size[1] * scale))
+
+
+def _confirm_pixels(img: Image.Image, shape: tuple[int, int]) -> np.ndarray:
+    # 模糊后一两个像素的错位和扫描噪声影响不大，文字内容不同仍能区分
+    small = img.convert('L').resize(shape, Image.Resampling.BOX)
+    return np.asarray(small.filter(ImageFilter.GaussianBlur(1)), dtype=np.float64)
+
+
+def _correlation(a: np.ndarray, b: np.ndarray) -> float:
+    """b 相对 a 平移不超过 CONFIRM_SHIFT 时的最大相关系数"""
+    shift = CONFIRM_SHIFT if min(a.shape) > 4 * CONFIRM_SHIFT else 0
+    height, width = a.shape
+    x = a[shift : height - shift, shift : width - shift]
+    x = x - x.mean()
+    best = -1.0
+    for dy in range(-shift, shift + 1):
+        for dx in range(-shift, shift + 1):
+            y = b[shift + dy : height - shift + dy, shift + dx : width - shift + dx]
+            y = y - y.mean()
+            denom = math.sqrt((x * x).sum() * (y * y).sum())
+            if denom == 0:
+                # 空白图片：两张都没有起伏才算一致
+                if not x.any() and not y.any():
+                    return 1.0
+                continue
+            best = max(best, float((x * y).sum()) / denom)
+    return best
+
+
+def similar(
+    img: Image.Image,
+    size: tuple[int, int],
+    other: Image.Image,
+    other_size: tuple[int, int],
+) -> bool:
+    """两张图片是否尺寸相近、内容一致
+
+    img、other 可以是全分辨率尺寸为 size、other_size 的缩小图。
+    """
+    if not _similar_size(size, other_size):
+        return False
+    shape = _confirm_shape(size)
+    a = _confirm_pixels(img, shape)
+    return _correlation(a, _confirm_pixels(other, shape)) >= MIN_CORRELATION
+
+
+def _load_for_confirm(path: str) -> tuple[Image.Image, tuple[int, int]]:
+    size = image_size(path)
+    factor = reduce_factor(_confirm_shape(size)[0] / size[0])
+    return load_image(path, factor), size
+
+
+def confirm(img: Image.Image, size: tuple[int, int], other: str) -> bool:
+    """img 与索引中的候选文件 other 是否一致，文件已删除或无法读取时不算重复"""
+    try:
+        if not _similar_size(size, image_size(other)):
+            return False
+        other_img, other_size = _load_for_confirm(other)
+    except (OSError, ValueError):
+        return False
+    return similar(img, size, other_img, other_size)
+
+
+def confirm_files(path: str, other: str) -> bool:
+    """两个文件（可以是 '文件#页码'）的内容是否一致"""
+    try:
+        img, size = _load_for_confirm(path)
+    except (OSError, ValueError):
+        return False
+    return confirm(img, size, other)
+
+
+def file_phash(path: Path | str) -> int:
+    """整页图片的哈希，JPEG 按 DCT 缩小解码"""
+    with perf.span('phash'):
+        factor = reduce_factor(PAGE_SIDE / max(image_size(path)))
+        return phash(load_image(path, factor))
+
+
+def hamming(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+def _bands(h: int) -> list[int]:
+    mask = (1 << BAND_BITS) - 1
+    return [(h >> (BAND_BITS * i)) & mask for i in range(BANDS)]
+
+
+def _neighbors(value: int, radius: int) -> list[int]:
+    """与 value 的汉明距离不超过 radius 的所有 BAND_BITS 位整数"""
+    result = [value]
+    frontier = [(value, -1)]
+    for _ in range(radius):
+        # 只翻转比上次更高的位，每个组合只生成一次
+        frontier = [
+            (v ^ (1 << bit), bit)
+            for v, last in frontier
+            for bit in range(last + 1, BAND_BITS)
+        ]
+        result.extend(v for v, _ in frontier)
+    return result
+
+
+def _to_sql(h: int) -> int:
+    # SQLite 整数为有符号 64 位
+    return h - (1 << 64) if h >= 1 << 63 else h
+
+
+def _from_sql(h: int) -> int:
+    return h + (1 << 64) if h < 0 else h
+
+
+class HashIndex:
+    """持久化的感知哈希索引，按 kind（'page' 或 'crop'）分别查询
+
+    查询汉明距离不超过 d 的哈希时采用多索引哈希：两个哈希距离不超过 d，
+    则 4 段中至少有一段距离不超过 d // 4，只需在每段的索引中查找这些邻近值，
+    再对候选计算完整距离，条目达到百万级时仍只读取少量行。
+    """
+
+    def __init__(self, path: Path | str = HASH_DB, readonly: bool = False):
+        self.path = path
+        if readonly:
+            self._conn = sqlite3.connect(
+                f"file:{path}?mode=ro", uri=True, check_same_thread=False
+            )
+            return
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        bands = ''.join(f', b{i} INTEGER NOT NULL' for i in range(BANDS))
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS hashes ('
+            'kind TEXT NOT NULL, name TEXT NOT NULL, hash INTEGER NOT NULL'
+            f'{bands}, PRIMARY KEY (kind, name))'
+        )
+        for i in range(BANDS):
+            self._conn.execute(
+                f'CREATE INDEX IF NOT EXISTS hashes_b{i} ON hashes (kind, b{i})'
+            )
+        self._conn.commit()
+
+    def close(self):
+        self._conn.close()
+
+    def commit(self):
+        self._conn.commit()
+
+    def __len__(self) -> int:
+        return self._conn.execute('SELECT COUNT(*) FROM hashes').fetchone()[0]
+
+    def add(self, kind: str, name: str, h: int):
+        """添加或替换一条记录，调用 commit() 后写入磁盘"""
+        self._conn.execute(
+            f'INSERT OR REPLACE INTO hashes VALUES (?, ?, ?{", ?" * BANDS})',
+            (kind, name, _to_sql(h), *_bands(h)),
+        )
+
+    def remove(self, kind: str, name: str):
+        self._conn.execute(
+            'DELETE FROM hashes WHERE kind = ? AND name = ?', (kind, name)
+        )
+
+    def find(self, kind: str, h: int, max_distance: int) -> list[tuple[str, int]]:
+        """距离不超过 max_distance 的 (名字, 距离)，近的在前"""
+        radius = max_distance // BANDS
+        hits = {}
+        for i, value in enumerate(_bands(h)):
+            for name, other in self._candidates(kind, i, _neighbors(value, radius)):
+                if name in hits:
+                    continue
+                distance = hamming(h, _from_sql(other))
+                if distance <= max_distance:
+                    hits[name] = distance
+        return sorted(hits.items(), key=lambda item: (item[1], item[0]))
+
+    def _candidates(
+        self, kind: str, band: int, values: list[int]
+    ) -> Iterator[tuple[str, int]]:
+        # 分批查询，避免超过 SQLite 的参数个数上限
+        for start in range(0, len(values), 900):
+            chunk = values[start : start + 900]
+            yield from self._conn.execute(
+                f'SELECT name, hash FROM hashes WHERE kind = ? AND b{band} IN '
+                f'({", ".join("?" * len(chunk))})',
+                (kind, *chunk),
+            )
+
+
+class Dedup(NamedTuple):
+    """近似重复检测设置，可传给工作进程
+
+    mode 为 'flag' 时照常处理并标出重复，'skip' 时跳过重复的页面或分割图片。
+    哈希距离不超过 max_distance 的只是候选，还要经 similar() 核对。
+    """
+
+    path: str = HASH_DB
+    mode: str = 'flag'
+    max_distance: int = 8
+
+    @property
+    def skip(self) -> bool:
+        return self.mode == 'skip'
+
+
+class DuplicateFilter:
+    """工作进程中的近似重复检查：只读查询已提交的索引，并记住本批次的图片
+
+    条目名为 index_key() 给出的绝对路径。索引只由主进程写入；可在多个线程中使用。
+    """
+
+    def __init__(self, dedup: Dedup, kind: str):
+        self.dedup = dedup
+        self.kind = kind
+        self._lock = threading.Lock()
+        self._local: list[tuple[str, int, Image.Image]] = []
+        try:
+            self._index = HashIndex(dedup.path, readonly=True)
+            self._index.find(kind, 0, 0)
+        except sqlite3.Error:
+            # 索引尚未建立
+            self._index = None
+
+    def check(self, key: str, img: Image.Image) -> tuple[int, str | None]:
+        """返回 (img 的哈希, 与之近似重复的已有条目)，没有重复时记住 img"""
+        h = phash(img)
+        with self._lock:
+            for other, other_h, other_img in self._local:
+                if hamming(h, other_h) <= self.dedup.max_distance and similar(
+                    img, img.size, other_img, other_img.size
+                ):
+                    return h, other
+            if self._index is not None:
+                for other, _ in self._index.find(self.kind, h, self.dedup.max_distance):
+                    # 同名条目是同一输出的旧记录，不算重复
+                    if other != key and confirm(img, img.size, other):
+                        return h, other
+            self._local.append((key, h, img))
+            return h, None
+
+    def close(self):
+        self._local = []
+        if self._index is not None:
+            self._index.close()
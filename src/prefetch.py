@@ -0,0 +1,97 @@
+from collections.abc import Callable
+
+from PySide6 import QtCore, QtGui
+
+from src import perf
+from src.display import pil_to_qimage
+from src.image_cache import ImageCache
+from src.image_state import ImageState
+from src.tiles import needs_tiling
+
+
+class _PrefetchJob(QtCore.QRunnable):
+    def __init__(self, prefetcher: 'Prefetcher', state: ImageState, factor: int):
+        super().__init__()
+        self._prefetcher = prefetcher
+        self._state = state
+        self._factor = factor
+        self._key = (state.path, state.angle, factor)
+
+    def run(self):
+        # 用户已跳到别处，放弃过期任务
+        if self._key not in self._prefetcher.wanted:
+            return
+        img = self._state.get_display_image(self._factor)
+        if self._key not in self._prefetcher.wanted:
+            return
+        # QPixmap 只能在 GUI 线程创建，这里只准备好 QImage
+        qimg, data = pil_to_qimage(img)
+        self._prefetcher.ready.emit(self._key, (qimg, data))
+
+
+class Prefetcher(QtCore.QObject):
+    """在线程池中预先解码、旋转前后几张图片，结果放入 pixmap 缓存
+
+    factor_for(state) 给出该图片显示时的缩小倍数，缓存键为 (路径, 角度, 倍数)。
+    """
+
+    ready = QtCore.Signal(object, object)
+
+    def __init__(
+        self,
+        pixmaps: ImageCache,
+        ahead: int = 2,
+        behind: int = 1,
+        max_threads: int = 2,
+        factor_for: Callable[[ImageState], int] = lambda state: 1,
+        parent: QtCore.QObject | None = None,
+    ):
+        super().__init__(parent)
+        self.pixmaps = pixmaps
+        self.factor_for = factor_for
+        self.ahead = ahead
+        self.behind = behind
+        # 当前需要预取的 (路径, 角度, 倍数)，每次调度整体替换
+        self.wanted: frozenset = frozenset()
+        self._pool = QtCore.QThreadPool(self)
+        self._pool.setMaxThreadCount(max_threads)
+        self.ready.connect(self._on_ready)
+
+    def schedule(self, images: list[ImageState], cur_idx: int):
+        # 丢弃尚未开始的旧任务，正在运行的任务会自行检查 wanted
+        self._pool.clear()
+        # 先近后远，向后翻页优先
+        order = []
+        for step in range(1, max(self.ahead, self.behind) + 1):
+            if step <= self.ahead:
+                order.append(cur_idx + step)
+            if step <= self.behind:
+                order.append(cur_idx - step)
+        # 超大图片由分块显示按需加载，不整张预取
+        jobs = [
+            (images[idx], self.factor_for(images[idx]))
+            for idx in order
+            if 0 <= idx < len(images) and not needs_tiling(images[idx])
+        ]
+        self.wanted = frozenset(
+            (state.path, state.angle, factor) for state, factor in jobs
+        )
+        for state, factor in jobs:
+            if (state.path, state.angle, factor) not in self.pixmaps:
+                self._pool.start(_PrefetchJob(self, state, factor))
+
+    def cancel(self):
+        self.wanted = frozenset()
+        self._pool.clear()
+
+    def shutdown(self):
+        self.cancel()
+        self._pool.waitForDone()
+
+    def _on_ready(self, key, payload):
+        if key not in self.wanted or key in self.pixmaps:
+            return
+        qimg, _data = payload
+        with perf.span('pixmap_upload'):
+            pixmap = QtGui.QPixmap.fromImage(qimg)
+        self.pixmaps.put(key, pixmap)
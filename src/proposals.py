@@ -0,0 +1,128 @@
+import math
+from collections import OrderedDict
+from collections.abc import Callable
+
+import numpy as np
+from PySide6 import QtCore
+
+from src import perf
+from src.image_state import (
+    ImageState,
+    Rect,
+    reduce_factor,
+    rotate_image,
+    rotated_size,
+)
+
+# 在长边约为该值的缩小图上分割，建议框只需大致准确
+PROPOSAL_SIDE = 1600
+# 最多记住的 (图片, 角度) 数
+PROPOSAL_CACHE = 2000
+
+# segment(灰度图, 最小空白高度) -> [(x0, y0, x1, y1), ...]
+Segmenter = Callable[[np.ndarray, int], list[tuple[int, int, int, int]]]
+
+
+def propose_rects(
+    state: ImageState, angle: int, segment: Segmenter, min_blank_height: int = 30
+) -> list[Rect]:
+    """在旋转后的缩小灰度图上分割，返回全分辨率显示坐标下的建议框"""
+    w, h = rotated_size(state.size, angle)
+    factor = reduce_factor(PROPOSAL_SIDE / max(w, h))
+    with perf.span('propose'):
+        gray = rotate_image(state.reduced(factor).convert('L'), angle)
+        # 缩小图的尺寸向上取整，旋转后还会变化，按实际比例换算回全分辨率
+        sx, sy = w / gray.width, h / gray.height
+        boxes = segment(np.asarray(gray), max(1, round(min_blank_height / sy)))
+    rects = []
+    for x0, y0, x1, y1 in boxes:
+        x0, y0 = int(x0 * sx), int(y0 * sy)
+        x1, y1 = min(w, math.ceil(x1 * sx)), min(h, math.ceil(y1 * sy))
+        if x1 > x0 and y1 > y0:
+            rects.append((x0, y0, x1 - x0, y1 - y0))
+    return rects
+
+
+class _ProposalJob(QtCore.QRunnable):
+    def __init__(self, proposer: 'Proposer', state: ImageState, angle: int):
+        super().__init__()
+        # Proposer 持有任务直到收到结果，tryTake() 时对象仍然有效
+        self.setAutoDelete(False)
+        self._proposer = proposer
+        self._state = state
+        self._key = (state.path, angle)
+
+    def run(self):
+        if self._key not in self._proposer.wanted:
+            self._proposer.skipped.emit(self._key)
+            return
+        try:
+            rects = propose_rects(self._state, self._key[1], self._proposer.segment)
+        except Exception:
+            # 无法读取或分割失败时不给建议，不能让该键一直挂起
+            rects = []
+        self._proposer.ready.emit(self._key, rects)
+
+
+class Proposer(QtCore.QObject):
+    """在后台线程中对当前及后面几张图片做空白分割，生成建议框
+
+    结果按 (路径, 角度) 缓存，同一张图片同一角度只分割一次。
+    ready(键, 建议框) 在 GUI 线程中发出。
+    """
+
+    ready = QtCore.Signal(object, object)
+    # 任务开始时已不再需要该键，放弃分割
+    skipped = QtCore.Signal(object)
+
+    def __init__(
+        self,
+        segment: Segmenter,
+        ahead: int = 2,
+        parent: QtCore.QObject | None = None,
+    ):
+        super().__init__(parent)
+        self.segment = segment
+        self.ahead = ahead
+        self.wanted: frozenset = frozenset()
+        self._results: OrderedDict[tuple, list[Rect]] = OrderedDict()
+        # 已排队或正在运行的任务，收到 ready 或 skipped 时移除
+        self._jobs: dict[tuple, _ProposalJob] = {}
+        self._pool = QtCore.QThreadPool(self)
+        self._pool.setMaxThreadCount(1)
+        # 先于外部连接，外部收到信号时结果已在缓存中
+        self.ready.connect(self._on_ready)
+        self.skipped.connect(self._on_skipped)
+
+    def get(self, state: ImageState) -> list[Rect] | None:
+        """已算好的建议框，尚未完成时返回 None"""
+        return self._results.get((state.path, state.angle))
+
+    def schedule(self, images: list[ImageState], cur_idx: int):
+        states = images[cur_idx : cur_idx + 1 + self.ahead]
+        self.wanted = frozenset((state.path, state.angle) for state in states)
+        # 只撤下不再需要且尚未开始的任务；正在运行的任务照常完成，
+        # 仍需要的任务保留，同一键不会重复分割
+        for key, job in list(self._jobs.items()):
+            if key not in self.wanted and self._pool.tryTake(job):
+                del self._jobs[key]
+        for state in states:
+            key = (state.path, state.angle)
+            if key in self._results or key in self._jobs:
+                continue
+            job = self._jobs[key] = _ProposalJob(self, state, state.angle)
+            self._pool.start(job)
+
+    def shutdown(self):
+        self.wanted = frozenset()
+        self._pool.clear()
+        self._pool.waitForDone()
+
+    def _on_skipped(self, key: tuple):
+        self._jobs.pop(key, None)
+
+    def _on_ready(self, key: tuple, rects: list[Rect]):
+        self._jobs.pop(key, None)
+        self._results[key] = rects
+        while len(self._results) > PROPOSAL_CACHE:
+            self._results.popitem(last=False)
@@ -0,0 +1,126 @@
+from collections.abc import Iterable, Iterator
+
+# 框 (x, y, w, h)，旋转后显示图上的整数坐标
+Rect = tuple[int, int, int, int]
+
+# 空间索引网格边长（像素）
+GRID_CELL = 256
+
+
+def iou(a: Rect, b: Rect) -> float:
+    """两个框的交并比"""
+    ax, ay, aw, ah = a
+    bx, by, bw, bh = b
+    iw = min(ax + aw, bx + bw) - max(ax, bx)
+    ih = min(ay + ah, by + bh) - max(ay, by)
+    if iw <= 0 or ih <= 0:
+        return 0.0
+    inter = iw * ih
+    return inter / (aw * ah + bw * bh - inter)
+
+
+class RectStore:
+    """单张图片的框集合
+
+    每个框有稳定的 id，修改或删除按 id 进行，两个相同的框互不影响。
+    按插入顺序迭代得到 (x, y, w, h)，读取方式与列表相同。
+    另按固定大小的网格建立空间索引，点选和重叠查询只检查相关网格中的框。
+    """
+
+    __slots__ = ('cell', '_rects', '_cells', '_next_id')
+
+    def __init__(self, rects: Iterable[Rect] = (), cell: int = GRID_CELL):
+        self.cell = cell
+        self._rects: dict[int, Rect] = {}
+        self._cells: dict[tuple[int, int], set[int]] = {}
+        self._next_id = 0
+        for rect in rects:
+            self.add(rect)
+
+    def __len__(self) -> int:
+        return len(self._rects)
+
+    def __iter__(self) -> Iterator[Rect]:
+        return iter(self._rects.values())
+
+    def __repr__(self) -> str:
+        return f"RectStore({list(self._rects.values())})"
+
+    def _cells_of(self, rect: Rect) -> Iterator[tuple[int, int]]:
+        x, y, w, h = rect
+        c = self.cell
+        # 按闭区间计算，落在右/下边上的点也能查到
+        for cx in range(x // c, (x + w) // c + 1):
+            for cy in range(y // c, (y + h) // c + 1):
+                yield cx, cy
+
+    def _index(self, rid: int, rect: Rect):
+        for key in self._cells_of(rect):
+            self._cells.setdefault(key, set()).add(rid)
+
+    def _unindex(self, rid: int, rect: Rect):
+        for key in self._cells_of(rect):
+            ids = self._cells[key]
+            ids.discard(rid)
+            if not ids:
+                del self._cells[key]
+
+    def add(self, rect: Rect) -> int:
+        """添加一个框，返回其 id"""
+        rid = self._next_id
+        self._next_id += 1
+        rect = tuple(int(v) for v in rect)
+        self._rects[rid] = rect
+        self._index(rid, rect)
+        return rid
+
+    # 与 list.append 同名，便于按列表方式追加
+    append = add
+
+    def get(self, rid: int) -> Rect:
+        return self._rects[rid]
+
+    def items(self) -> Iterator[tuple[int, Rect]]:
+        return iter(self._rects.items())
+
+    def update(self, rid: int, rect: Rect):
+        old = self._rects[rid]
+        rect = tuple(int(v) for v in rect)
+        if rect == old:
+            return
+        self._unindex(rid, old)
+        self._rects[rid] = rect
+        self._index(rid, rect)
+
+    def remove(self, rid: int) -> Rect:
+        rect = self._rects.pop(rid)
+        self._unindex(rid, rect)
+        return rect
+
+    def pop(self) -> tuple[int, Rect]:
+        """删除最后添加的框，返回 (id, 框)"""
+        rid = next(reversed(self._rects))
+        return rid, self.remove(rid)
+
+    def at(self, x: float, y: float) -> list[int]:
+        """包含点 (x, y) 的框，面积小的在前"""
+        key = (int(x) // self.cell, int(y) // self.cell)
+        hits = []
+        for rid in self._cells.get(key, ()):
+            rx, ry, rw, rh = self._rects[rid]
+            if rx <= x <= rx + rw and ry <= y <= ry + rh:
+                hits.append(rid)
+        return sorted(hits, key=lambda rid: self._rects[rid][2] * self._rects[rid][3])
+
+    def overlapping(self, rect: Rect) -> list[int]:
+        """与 rect 有重叠面积的框，按添加顺序"""
+        x, y, w, h = rect
+        candidates = set()
+        for key in self._cells_of(tuple(int(v) for v in rect)):
+            candidates |= self._cells.get(key, set())
+        hits = []
+        for rid in candidates:
+            rx, ry, rw, rh = self._rects[rid]
+            if rx < x + w and x < rx + rw and ry < y + h and y < ry + rh:
+                hits.append(rid)
+        return sorted(hits)
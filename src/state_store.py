@@ -0,0 +1,108 @@
+import json
+import os
+import sqlite3
+from collections.abc import Iterable
+from pathlib import Path
+
+from src import perf
+from src.image_state import (
+    ImageState,
+    Rect,
+    read_legacy_states,
+    write_legacy_states,
+)
+
+STATE_DB = 'image_states.db'
+
+
+class StateStore:
+    """以图片名为键的 SQLite 状态库
+
+    每张图片一行，可按名字单独查询；save 只写入与上次保存相比有变化的图片，
+    WAL 模式下每次提交只追加日志，适合频繁自动保存。
+    """
+
+    def __init__(self, path: Path | str = STATE_DB):
+        self.path = path
+        self._conn = sqlite3.connect(path)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS states ('
+            'name TEXT PRIMARY KEY, angle INTEGER NOT NULL, rects TEXT NOT NULL)'
+        )
+        self._conn.commit()
+        # 各图片最近一次读取或写入库中的内容，用于判断是否需要保存
+        self._saved: dict[str, tuple[int, list[Rect]]] = {}
+
+    def close(self):
+        self._conn.close()
+
+    def get(self, name: str) -> tuple[int, list[Rect]] | None:
+        row = self._conn.execute(
+            'SELECT angle, rects FROM states WHERE name = ?', (name,)
+        ).fetchone()
+        if row is None:
+            return None
+        return row[0], [tuple(r) for r in json.loads(row[1])]
+
+    def items(self) -> Iterable[tuple[str, int, list[Rect]]]:
+        for name, angle, rects in self._conn.execute(
+            'SELECT name, angle, rects FROM states ORDER BY name'
+        ):
+            yield name, angle, [tuple(r) for r in json.loads(rects)]
+
+    def put(self, name: str, angle: int, rects: list[Rect]):
+        self._write([(name, angle, rects)])
+
+    def load_into(self, states: Iterable[ImageState]) -> int:
+        """把库中的状态应用到对应的 ImageState，返回应用的数量"""
+        by_name = {os.path.basename(state.path): state for state in states}
+        count = 0
+        for name, angle, rects in self._conn.execute(
+            'SELECT name, angle, rects FROM states'
+        ):
+            state = by_name.get(name)
+            if state is None:
+                continue
+            rects = [tuple(r) for r in json.loads(rects)]
+            state.angle = angle
+            state.rects = list(rects)
+            self._saved[name] = (angle, rects)
+            count += 1
+        return count
+
+    def save(self, states: Iterable[ImageState]) -> int:
+        """保存有变化的图片状态，返回写入的数量"""
+        changed = []
+        for state in states:
+            name = os.path.basename(state.path)
+            current = (state.angle, list(state.rects))
+            if self._saved.get(name, (0, [])) != current:
+                changed.append((name, *current))
+        if changed:
+            with perf.span('store.save'):
+                self._write(changed)
+        return len(changed)
+
+    def _write(self, entries: list[tuple[str, int, list[Rect]]]):
+        with self._conn:
+            for name, angle, rects in entries:
+                if angle == 0 and not rects:
+                    self._conn.execute('DELETE FROM states WHERE name = ?', (name,))
+                else:
+                    self._conn.execute(
+                        'INSERT OR REPLACE INTO states (name, angle, rects) '
+                        'VALUES (?, ?, ?)',
+                        (name, angle, json.dumps(rects)),
+                    )
+                self._saved[name] = (angle, list(rects))
+
+    def import_legacy(self, load_path: Path | str) -> int:
+        """导入 image_states.txt 文本格式，返回导入的图片数"""
+        entries = read_legacy_states(load_path)
+        self._write([(name, angle, rects) for name, (angle, rects) in entries.items()])
+        return len(entries)
+
+    def export_legacy(self, save_path: Path | str):
+        write_legacy_states(self.items(), save_path)
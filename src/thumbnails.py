@@ -0,0 +1,67 @@
+import hashlib
+import os
+from pathlib import Path
+
+from PIL import Image
+
+from src import perf
+from src.image_state import image_size, load_image, reduce_factor
+from src.pages import split_page
+
+THUMB_DIR = '.thumbnails'
+THUMB_SIZE = 160
+
+
+class ThumbnailCache:
+    """磁盘上的缩略图缓存，不依赖 Qt
+
+    键由图片绝对路径、文件大小、修改时间和缩略图尺寸组成，原图变化后自动失效，
+    命中时只读取一个小 JPEG，不解码原图。缩略图是按 EXIF 摆正、未旋转的图片。
+    """
+
+    def __init__(self, cache_dir: Path | str = THUMB_DIR, size: int = THUMB_SIZE):
+        self.cache_dir = cache_dir
+        self.size = size
+
+    def path_for(self, path: Path | str) -> str:
+        # 多页文件的各页共用文件的大小和修改时间，路径中含页码
+        st = os.stat(split_page(path)[0])
+        key = f"{os.path.abspath(path)}|{st.st_size}|{st.st_mtime_ns}|{self.size}"
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        # 按前两位分目录，避免单个目录下文件过多
+        return os.path.join(self.cache_dir, digest[:2], digest + '.jpg')
+
+    def get(self, path: Path | str) -> Image.Image:
+        """读取缩略图，缓存中没有时从原图生成并写入"""
+        thumb_path = self.path_for(path)
+        try:
+            with Image.open(thumb_path) as thumb:
+                thumb.load()
+                return thumb
+        except (OSError, ValueError):
+            pass
+        thumb = self.make(path)
+        self._write(thumb_path, thumb)
+        return thumb
+
+    def make(self, path: Path | str) -> Image.Image:
+        with perf.span('thumbnail'):
+            # JPEG 直接按 DCT 缩小解码，缩小后仍不小于缩略图尺寸
+            factor = reduce_factor(self.size / max(image_size(path)))
+            img = load_image(path, factor)
+            if img.mode not in ('L', 'RGB'):
+                img = img.convert('RGB')
+            img.thumbnail((self.size, self.size))
+        return img
+
+    def _write(self, thumb_path: str, thumb: Image.Image):
+        os.makedirs(os.path.dirname(thumb_path), exist_ok=True)
+        # 先写临时文件再改名，多个线程同时生成同一张时不会读到半个文件
+        tmp_path = f"{thumb_path}.{os.getpid()}.{id(thumb)}.tmp"
+        try:
+            thumb.save(tmp_path, 'JPEG', quality=85)
+            os.replace(tmp_path, thumb_path)
+        except OSError:
+            # 缓存目录不可写时只是不缓存
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
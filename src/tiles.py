@@ -0,0 +1,211 @@
+import math
+
+from PIL import Image
+from PySide6 import QtCore, QtGui, QtWidgets
+
+from src.display import pil_to_qimage, pixmap_nbytes
+from src.image_cache import ImageCache
+from src.image_state import MAX_REDUCE_FACTOR, ImageState, load_image, rotate_image
+from src.pages import is_pdf, split_page
+
+TILE_SIZE = 512
+# 像素数超过该值的图片改用分块金字塔显示
+TILED_MIN_PIXELS = 40_000_000
+
+
+def needs_tiling(state: ImageState) -> bool:
+    w, h = state.size
+    return w * h >= TILED_MIN_PIXELS
+
+
+def _decodes_reduced(path: str) -> bool:
+    """JPEG 可按 DCT 缩小解码、PDF 可按缩小的分辨率渲染，不必先得到全分辨率"""
+    path = split_page(path)[0]
+    return is_pdf(path) or path.lower().endswith(('.jpg', '.jpeg'))
+
+
+def level_image(
+    levels: ImageCache, state: ImageState, angle: int, level: int
+) -> Image.Image:
+    """旋转后缩小 2**level 倍的整图，存在 levels 中
+
+    levels 对同一层只加载一次，多个分块线程同时请求时只解码、缩小一次。
+    JPEG 和 PDF 的较粗层级直接按缩小的分辨率解码，其他层级由上一层缩小得到。
+    """
+
+    def load():
+        factor = 1 << level
+        if level == 0 or (factor <= MAX_REDUCE_FACTOR and _decodes_reduced(state.path)):
+            return rotate_image(load_image(state.path, factor), angle)
+        return level_image(levels, state, angle, level - 1).reduce(2)
+
+    return levels.get(level, load)
+
+
+class _TileJob(QtCore.QRunnable):
+    def __init__(
+        self,
+        item: 'TiledImageItem',
+        state: ImageState,
+        levels: ImageCache,
+        key: tuple,
+    ):
+        super().__init__()
+        self._item = item
+        self._state = state
+        self._levels = levels
+        self._key = key
+
+    def run(self):
+        path, angle, level, tx, ty = self._key
+        # 已切换到别的图片或角度，放弃
+        if self._item.source != (path, angle):
+            return
+        base = level_image(self._levels, self._state, angle, level)
+        x0, y0 = tx * TILE_SIZE, ty * TILE_SIZE
+        box = (
+            x0,
+            y0,
+            min(x0 + TILE_SIZE, base.width),
+            min(y0 + TILE_SIZE, base.height),
+        )
+        qimg, data = pil_to_qimage(base.crop(box))
+        self._item.tile_ready.emit(self._key, (qimg, data))
+
+
+class TiledImageItem(QtWidgets.QGraphicsObject):
+    """分块多分辨率图片项
+
+    场景坐标始终是全分辨率（旋转后）坐标，绘制时按当前缩放选取金字塔层级，
+    只加载视口内可见的分块。分块在后台线程生成，缓存满时按 LRU 淘汰。
+    """
+
+    tile_ready = QtCore.Signal(object, object)
+
+    def __init__(self, parent: QtWidgets.QGraphicsItem | None = None):
+        super().__init__(parent)
+        # 需要 exposedRect 只绘制可见区域
+        self.setFlag(
+            QtWidgets.QGraphicsItem.GraphicsItemFlag.ItemUsesExtendedStyleOption
+        )
+        self._state: ImageState | None = None
+        self.source: tuple | None = None
+        self._size = (0, 0)
+        self._max_level = 0
+        self._tiles = ImageCache(128 * 1024 * 1024, nbytes=pixmap_nbytes)
+        self._pending: set[tuple] = set()
+        # 当前页的各层整图，不放进 ImageState 的共享缓存：大幅面扫描的第 0 层
+        # 就超过其容量，会把其余条目全部挤掉；切换页面或角度时整体换掉
+        self._levels = ImageCache(math.inf)
+        self._pool = QtCore.QThreadPool(self)
+        self._pool.setMaxThreadCount(max(2, QtCore.QThread.idealThreadCount() - 1))
+        self._requests = 0
+        self.tile_ready.connect(self._on_tile_ready)
+
+    def set_state(self, state: ImageState | None):
+        if state is not None and (state.path, state.angle) == self.source:
+            # 同一页、同一角度重新显示时保留已生成的各层和分块
+            return
+        self.prepareGeometryChange()
+        self._pool.clear()
+        self._pending.clear()
+        self._state = state
+        # 仍在运行的分块任务持有旧的 levels，结束后随之释放
+        self._levels = ImageCache(math.inf)
+        if state is None:
+            self.source = None
+            self._size = (0, 0)
+        else:
+            self.source = (state.path, state.angle)
+            self._size = state.display_size
+        # 最粗一层整张图不超过一个分块
+        longest = max(self._size)
+        self._max_level = (
+            max(0, math.ceil(math.log2(longest / TILE_SIZE))) if longest else 0
+        )
+        self.update()
+
+    def shutdown(self):
+        self.source = None
+        self._pool.clear()
+        self._pool.waitForDone()
+
+    def boundingRect(self) -> QtCore.QRectF:
+        return QtCore.QRectF(0, 0, *self._size)
+
+    def paint(
+        self,
+        painter: QtGui.QPainter,
+        option: QtWidgets.QStyleOptionGraphicsItem,
+        widget: QtWidgets.QWidget | None = None,
+    ):
+        if self._state is None:
+            return
+        lod = option.levelOfDetailFromTransform(painter.worldTransform())
+        level = 0
+        if 0 < lod < 1:
+            level = min(self._max_level, int(math.log2(1 / lod)))
+        painter.setRenderHint(QtGui.QPainter.RenderHint.SmoothPixmapTransform)
+        exposed = option.exposedRect.intersected(self.boundingRect())
+        span = TILE_SIZE << level
+        for ty in range(int(exposed.top()) // span, math.ceil(exposed.bottom() / span)):
+            for tx in range(
+                int(exposed.left()) // span, math.ceil(exposed.right() / span)
+            ):
+                self._draw_tile(painter, level, tx, ty)
+
+    def _draw_tile(self, painter: QtGui.QPainter, level: int, tx: int, ty: int):
+        w, h = self._size
+        span = TILE_SIZE << level
+        target = QtCore.QRectF(tx * span, ty * span, span, span).intersected(
+            QtCore.QRectF(0, 0, w, h)
+        )
+        key = (*self.source, level, tx, ty)
+        pixmap = self._tiles.peek(key)
+        if pixmap is not None:
+            scale = 1 << level
+            painter.drawPixmap(
+                target,
+                pixmap,
+                QtCore.QRectF(0, 0, target.width() / scale, target.height() / scale),
+            )
+            return
+        self._request(key)
+        # 精细分块未就绪前，用已缓存的粗糙层级顶替
+        for coarse in range(level + 1, self._max_level + 1):
+            shift = coarse - level
+            coarse_key = (*self.source, coarse, tx >> shift, ty >> shift)
+            pixmap = self._tiles.peek(coarse_key)
+            if pixmap is None:
+                continue
+            coarse_span = TILE_SIZE << coarse
+            scale = 1 << coarse
+            origin = QtCore.QPointF(
+                (tx >> shift) * coarse_span, (ty >> shift) * coarse_span
+            )
+            source = QtCore.QRectF(
+                (target.x() - origin.x()) / scale,
+                (target.y() - origin.y()) / scale,
+                target.width() / scale,
+                target.height() / scale,
+            )
+            painter.drawPixmap(target, pixmap, source)
+            return
+
+    def _request(self, key: tuple):
+        if key in self._pending:
+            return
+        self._pending.add(key)
+        # 后请求的分块优先生成，快速平移时先显示当前视口
+        self._requests += 1
+        self._pool.start(_TileJob(self, self._state, self._levels, key), self._requests)
+
+    def _on_tile_ready(self, key: tuple, payload):
+        self._pending.discard(key)
+        if key[:2] != self.source:
+            return
+        qimg, _data = payload
+        self._tiles.put(key, QtGui.QPixmap.fromImage(qimg))
+        _, _, level, tx, ty = key
+        span = TILE_SIZE << level
+        self.update(QtCore.QRectF(tx * span, ty * span, span, span))
@@ -0,0 +1,115 @@
+import os
+import queue
+import threading
+import time
+from collections.abc import Iterable
+from pathlib import Path
+
+from src.image_state import IMAGE_EXTENSIONS
+from src.pages import expand_pages, split_page
+
+try:
+    # 可选依赖：有 inotify 时不必反复扫描目录
+    from inotify_simple import INotify, flags
+except ImportError:
+    INotify = None
+
+
+class FolderWatcher:
+    """在后台线程中监视目录，把新出现的图片路径放入有界队列
+
+    Linux 上安装了 inotify_simple 时按文件事件触发，否则每 poll_interval 秒扫描目录。
+    扫描仪可能还在写入，文件大小和修改时间连续 settle 秒不变才视为完成；
+    队列满时等待消费者取走，不丢弃文件。known 中的文件名不会放入队列。
+    多页文件按页放入 '文件#页码'；known 中也可以是这种页面名。
+    """
+
+    def __init__(
+        self,
+        directory: Path | str,
+        known: Iterable[str] = (),
+        maxsize: int = 64,
+        settle: float = 1.0,
+        poll_interval: float = 1.0,
+    ):
+        self.directory = directory
+        self.queue: queue.Queue[str] = queue.Queue(maxsize)
+        self.settle = settle
+        self.poll_interval = poll_interval
+        self._known = {split_page(name)[0] for name in known}
+        # 文件名 -> (大小, 修改时间, 该状态首次出现的时刻)
+        self._candidates: dict[str, tuple[int, int, float]] = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        inotify = None
+        if INotify is not None:
+            try:
+                inotify = INotify()
+                inotify.add_watch(
+                    self.directory, flags.CREATE | flags.CLOSE_WRITE | flags.MOVED_TO
+                )
+            except OSError:
+                inotify = None
+        # 启动前已存在但尚未处理的文件也要检查
+        self._scan()
+        while not self._stop.is_set():
+            if inotify is not None:
+                timeout = self.poll_interval if self._candidates else 1.0
+                for event in inotify.read(timeout=int(timeout * 1000)):
+                    self._add(event.name)
+            else:
+                self._stop.wait(self.poll_interval)
+                self._scan()
+            self._check()
+        if inotify is not None:
+            inotify.close()
+
+    def _scan(self):
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return
+        for name in names:
+            self._add(name)
+
+    def _add(self, name: str):
+        if (
+            name in self._known
+            or name in self._candidates
+            or not name.lower().endswith(IMAGE_EXTENSIONS)
+        ):
+            return
+        self._candidates[name] = (-1, -1, time.monotonic())
+
+    def _check(self):
+        now = time.monotonic()
+        for name, (size, mtime, since) in list(self._candidates.items()):
+            path = os.path.join(self.directory, name)
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                del self._candidates[name]
+                continue
+            if (st.st_size, st.st_mtime_ns) != (size, mtime):
+                self._candidates[name] = (st.st_size, st.st_mtime_ns, now)
+                continue
+            if st.st_size == 0 or now - since < self.settle:
+                continue
+            for page in expand_pages(path):
+                while not self._stop.is_set():
+                    try:
+                        self.queue.put(page, timeout=0.5)
+                        break
+                    except queue.Full:
+                        continue
+            self._known.add(name)
+            del self._candidates[name]
@@ -0,0 +1,246 @@
+import csv
+import io
+import os
+import queue
+import threading
+import time
+from pathlib import Path
+from typing import NamedTuple
+
+from PIL import Image
+
+from src import perf
+from src.phash import Dedup, DuplicateFilter, index_key
+
+# 格式名 -> (扩展名, PIL 格式, 参数含义, 默认参数)
+FORMATS = {
+    'png': ('.png', 'PNG', "压缩级别 0-9", 6),
+    'webp': ('.webp', 'WEBP', "无损压缩方法 0-6", 4),
+    'jpeg': ('.jpg', 'JPEG', "质量 1-95", 90),
+    'tiff': ('.tif', 'TIFF', "压缩方式 none/lzw/deflate", 'lzw'),
+}
+
+_TIFF_COMPRESSION = {'none': None, 'lzw': 'tiff_lzw', 'deflate': 'tiff_deflate'}
+
+
+class OutputFormat(NamedTuple):
+    """输出格式及其参数，参数为 None 时取默认值"""
+
+    name: str = 'png'
+    param: int | str | None = None
+
+    @property
+    def extension(self) -> str:
+        return FORMATS[self.name][0]
+
+    @property
+    def spec(self) -> str:
+        """规范化的 '格式:参数' 字符串，可记入清单比较"""
+        return f"{self.name}:{self.value}"
+
+    @property
+    def value(self) -> int | str:
+        return FORMATS[self.name][3] if self.param is None else self.param
+
+    def save_args(self, img: Image.Image) -> tuple[Image.Image, dict]:
+        """返回 (可保存的图片, Image.save 参数)"""
+        if self.name == 'png':
+            return img, {'compress_level': self.value}
+        if self.name == 'webp':
+            return img, {'lossless': True, 'method': self.value, 'quality': 100}
+        if self.name == 'jpeg':
+            if img.mode not in ('L', 'RGB', 'CMYK'):
+                img = img.convert('RGB')
+            return img, {'quality': self.value}
+        compression = _TIFF_COMPRESSION[self.value]
+        return img, {} if compression is None else {'compression': compression}
+
+
+def parse_format(spec: str) -> OutputFormat:
+    """解析 'png'、'png:1'、'webp:6'、'jpeg:85'、'tiff:deflate' 形式的格式说明"""
+    name, _, param = spec.lower().partition(':')
+    if name == 'jpg':
+        name = 'jpeg'
+    elif name == 'tif':
+        name = 'tiff'
+    if name not in FORMATS:
+        raise ValueError(f"Unsupported format: {spec}")
+    if not param:
+        return OutputFormat(name)
+    if name == 'tiff':
+        if param not in _TIFF_COMPRESSION:
+            raise ValueError(f"Unsupported TIFF compression: {param}")
+        return OutputFormat(name, param)
+    value = int(param)
+    low, high = {'png': (0, 9), 'webp': (0, 6), 'jpeg': (1, 95)}[name]
+    if not low <= value <= high:
+        raise ValueError(f"{name} parameter out of range {low}-{high}: {value}")
+    return OutputFormat(name, value)
+
+
+def format_help() -> str:
+    return "，".join(
+        f"{name}[:{meaning}]" for name, (_, _, meaning, _) in FORMATS.items()
+    )
+
+
+class WriteResult(NamedTuple):
+    """一个输出：文件名、字节数、编码耗时（秒）
+
+    开启去重时还有感知哈希，以及近似重复的已有图片（相对输出目录的路径）；
+    跳过写出的字节数为 0。
+    """
+
+    name: str
+    nbytes: int
+    seconds: float
+    phash: int | None = None
+    duplicate_of: str | None = None
+
+    @property
+    def skipped(self) -> bool:
+        """因近似重复而没有写出"""
+        return self.duplicate_of is not None and self.nbytes == 0
+
+
+def encode(img: Image.Image, fmt: OutputFormat) -> bytes:
+    img, kwargs = fmt.save_args(img)
+    buf = io.BytesIO()
+    img.save(buf, FORMATS[fmt.name][1], **kwargs)
+    return buf.getvalue()
+
+
+def write_atomic(path: str, data: bytes):
+    """先写临时文件再改名，中断时不会留下半个输出"""
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class CropWriter:
+    """输出阶段：调用方 submit 裁好的小图，后台线程编码并原子写盘
+
+    队列有界，编码跟不上时 submit 阻塞，内存中最多有 maxsize 张待写的图片。
+    Pillow 编码时释放 GIL，多个编码线程可与调用方的裁剪并行。
+    close()（或退出 with）等待全部写完，按提交顺序返回 WriteResult，
+    任一线程出错时在 close() 中重新抛出。
+    给出 dedup 时在 submit 中按提交顺序检查近似重复的分割图片。
+    """
+
+    def __init__(
+        self,
+        output_dir: Path | str,
+        fmt: OutputFormat = OutputFormat(),
+        threads: int = 2,
+        maxsize: int | None = None,
+        dedup: Dedup | None = None,
+    ):
+        self.output_dir = output_dir
+        self.fmt = fmt
+        self._filter = None if dedup is None else DuplicateFilter(dedup, 'crop')
+        self._queue: queue.Queue = queue.Queue(maxsize or threads * 2)
+        self._results: dict[int, WriteResult] = {}
+        self._error: BaseException | None = None
+        self._count = 0
+        self._threads = [
+            threading.Thread(target=self._run, daemon=True) for _ in range(threads)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is not None:
+            # 调用方出错时不再写剩余的图片
+            self._drain()
+        self.close()
+        return False
+
+    def submit(self, name: str, img: Image.Image):
+        """排队写出 output_dir/name，name 的扩展名应为 fmt.extension"""
+        if self._error is not None:
+            raise self._error
+        index = self._count
+        self._count += 1
+        if self._filter is not None:
+            h, other = self._filter.check(index_key(self.output_dir, name), img)
+            duplicate_of = (
+                None if other is None else os.path.relpath(other, self.output_dir)
+            )
+            if duplicate_of is not None and self._filter.dedup.skip:
+                self._results[index] = WriteResult(name, 0, 0.0, h, duplicate_of)
+                return
+            self._queue.put((index, name, img, h, duplicate_of))
+            return
+        self._queue.put((index, name, img, None, None))
+
+    def close(self) -> list[WriteResult]:
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        if self._filter is not None:
+            self._filter.close()
+            self._filter = None
+        if self._error is not None:
+            raise self._error
+        return [self._results[i] for i in sorted(self._results)]
+
+    def _drain(self):
+        while True:
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                return
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            if self._error is not None:
+                continue
+            index, name, img, h, duplicate_of = item
+            try:
+                start = time.perf_counter()
+                with perf.span('write.encode'):
+                    data = encode(img, self.fmt)
+                seconds = time.perf_counter() - start
+                with perf.span('write.io'):
+                    write_atomic(os.path.join(self.output_dir, name), data)
+            except BaseException as e:
+                self._error = e
+                continue
+            self._results[index] = WriteResult(
+                name, len(data), seconds, h, duplicate_of
+            )
+
+
+def summarize(results: list[WriteResult]) -> str:
+    nbytes = sum(r.nbytes for r in results)
+    seconds = sum(r.seconds for r in results)
+    text = f"共 {nbytes / 1024 / 1024:.1f} MB，编码 {seconds:.1f}s"
+    duplicates = sum(r.duplicate_of is not None for r in results)
+    if duplicates:
+        text += f"，{duplicates} 张近似重复"
+    return text
+
+
+def write_report(path: Path | str, results: list[WriteResult]):
+    """每个输出一行：文件名、字节数、编码毫秒、近似重复的已有图片"""
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        out = csv.writer(f)
+        out.writerow(['name', 'bytes', 'encode_ms', 'duplicate_of'])
+        for r in results:
+            out.writerow(
+                [r.name, r.nbytes, f"{r.seconds * 1000:.2f}", r.duplicate_of or '']
+            )